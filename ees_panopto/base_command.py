@@ -21,6 +21,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from .configuration import Configuration
 from .elastic_search_wrapper import ElasticSearchWrapper
 from .enterprise_search_wrapper import EnterpriseSearchWrapper
+from .fingerprint_store import FingerprintStore
 from .indexing_rule import IndexingRules
 from .local_storage import LocalStorage
 from .mssql_client import MSSQL
@@ -94,6 +95,21 @@ class BaseCommand:
     def elastic_search_custom_client(self):
         return ElasticSearchWrapper(self.logger, self.config, self.args)
 
+    @cached_property
+    def fingerprint_store(self):
+        """Get the fingerprints of the indexed documents, or None if unchanged documents
+        should be indexed again.
+        """
+        if not self.config.get_value("skip_unchanged_documents"):
+            return None
+
+        fingerprint_store = FingerprintStore(self.logger, self.elastic_search_custom_client.source)
+        # An emptied or recreated index needs every document again
+        if fingerprint_store.fingerprints and not self.elastic_search_custom_client.count_documents():
+            self.logger.info("The index is empty, ignoring the fingerprints of the previous runs")
+            fingerprint_store.clear()
+        return fingerprint_store
+
     @cached_property
     def config(self):
         """Get the configuration for the connector for the running command."""
@@ -107,6 +123,26 @@ class BaseCommand:
         """Get the Network Drives client instance for the running command."""
         return MSSQL(self.config, self.logger)
 
+    @cached_property
+    def fsd_search_portal_client(self):
+        """Get the FSD search portal client instance for the running command."""
+        return self.config.fsd_search_portal_client
+
+    def close_connection_pools(self):
+        """Log the metrics of the connection pools and of the extraction cache, and close the idle connections."""
+        pools = [self.fsd_search_portal_client.pool, self.config.tika_client]
+        if "mssql_client" in self.__dict__:
+            pools.append(self.mssql_client.pool)
+        if "leadtools_engine" in self.__dict__:
+            pools.append(self.leadtools_engine.pool)
+
+        for pool in pools:
+            self.logger.info(f"Connection pool {pool.name}: {pool.get_stats()}")
+            pool.close_all()
+
+        if self.config.extraction_cache:
+            self.logger.info(f"Extraction cache: {self.config.extraction_cache.get_stats()}")
+
     @cached_property
     def indexing_rules(self):
         """Get the object for indexing rules to check should the file be indexed or not
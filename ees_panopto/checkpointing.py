@@ -14,11 +14,28 @@
 """
 import json
 import os
+import threading
+import time
 
 from .constant import RFC_3339_DATETIME_FORMAT
 from .schema import coerce_rfc_3339_date
 
 CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), 'checkpoint.json')
+PARTITIONS_PATH = os.path.join(os.path.dirname(__file__), 'partitions.json')
+# minimum number of seconds between two writes of the progress of the blocks of the partitions
+PARTITIONS_SAVE_INTERVAL = 10
+
+
+def write_json_atomically(path, content):
+    """Writes the content to a temporary file which then replaces the file, so that an
+    interrupted write never leaves a truncated file
+    :param path: path of the json file
+    :param content: content to be written
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, "w", encoding="UTF-8") as temporary_file:
+        json.dump(content, temporary_file, indent=4)
+    os.replace(temporary_path, path)
 
 
 class IncorrectFormatError(Exception):
@@ -144,12 +161,269 @@ class Checkpoint:
             )
             checkpoint_list = {obj_type: checkpoint_time}
 
-        with open(CHECKPOINT_PATH, "w", encoding="UTF-8") as checkpoint_store:
-            try:
-                json.dump(checkpoint_list, checkpoint_store, indent=4)
-                self.logger.info("Successfully saved the checkpoint")
-            except ValueError as exception:
-                self.logger.exception(
-                    f"Error while updating the existing checkpoint json file. \
-                    Adding the new content directly instead of updating. Error: {exception}"
-                )
+        try:
+            write_json_atomically(CHECKPOINT_PATH, checkpoint_list)
+            self.logger.info("Successfully saved the checkpoint")
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while updating the existing checkpoint json file. \
+                Adding the new content directly instead of updating. Error: {exception}"
+            )
+
+    def get_watermark(self, obj_type):
+        """This method fetches the watermark stored for the object type in the checkpoint file,
+           or None if there is no watermark yet
+           :param obj_type: object type of the watermark
+        """
+        try:
+            with open(CHECKPOINT_PATH, encoding="UTF-8") as checkpoint_store:
+                watermark = json.load(checkpoint_store).get(obj_type)
+        except FileNotFoundError:
+            self.logger.debug(
+                f"Checkpoint file not found on path: {CHECKPOINT_PATH}. No watermark for {obj_type}"
+            )
+            return None
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while parsing the json file of the checkpoint store from path: {CHECKPOINT_PATH}. \
+                    Error: {exception}"
+            )
+            return None
+
+        self.logger.debug(f"Watermark of {obj_type}: {watermark}")
+        return watermark
+
+    def set_watermark(self, watermark, obj_type):
+        """This method stores the watermark of the object type in the checkpoint file,
+           keeping the other checkpoints
+           :param watermark: value of the watermark
+           :param obj_type: object type of the watermark
+        """
+        try:
+            with open(CHECKPOINT_PATH, encoding="UTF-8") as checkpoint_store:
+                checkpoint_list = json.load(checkpoint_store)
+        except (FileNotFoundError, ValueError):
+            checkpoint_list = {}
+
+        checkpoint_list[obj_type] = watermark
+
+        write_json_atomically(CHECKPOINT_PATH, checkpoint_list)
+        self.logger.info(f"Successfully saved the watermark {watermark} for {obj_type}")
+
+
+class PartitionCheckpoint:
+    """PartitionCheckpoint class records the progress of a sync, one date partition at a time.
+
+        The partitions of a run are stored with the start time of the last session of each
+        partition which was indexed, and whether the partition is complete. When a run is
+        interrupted, the next run of the same type resumes the unfinished partitions from
+        where they stopped instead of starting over.
+
+        The blocks of a partition are indexed by several consumers in any order, so the
+        progress of a partition only moves forward when all its previous blocks are indexed.
+        This progress is written at most every save_interval seconds, while the partitions
+        which are done are written right away.
+    """
+
+    def __init__(self, logger, obj_type, index_type, checkpoint_time, save_interval=PARTITIONS_SAVE_INTERVAL):
+        """
+        :param logger: logger object
+        :param obj_type: object type of the checkpoint
+        :param index_type: indexing type from "incremental" or "full"
+        :param checkpoint_time: time to store in the checkpoint once all the partitions are complete
+        :param save_interval: minimum number of seconds between two writes of the progress of the blocks
+        """
+        self.logger = logger
+        self.key = f"{obj_type}_{index_type}"
+        self.checkpoint_time = checkpoint_time
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        # progress recorded since the last write, and the time of that write
+        self.changed = False
+        self.last_save_time = 0
+        self.run = None
+        # index in the run of the partition of each time range handed out to the producers
+        self.indexes = {}
+        # progress of the blocks of each partition of the current run, by partition index
+        self.blocks = {}
+
+    def load(self):
+        """Loads the partitions of the interrupted run of this type, if any"""
+        try:
+            with open(PARTITIONS_PATH, encoding="UTF-8") as partitions_store:
+                return json.load(partitions_store).get(self.key)
+        except FileNotFoundError:
+            return None
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while parsing the json file of the partitions from path: {PARTITIONS_PATH}. Error: {exception}"
+            )
+            return None
+
+    def save(self):
+        """Writes the progress of the current run, keeping the runs of the other types.
+        Must be called with the lock held"""
+        try:
+            with open(PARTITIONS_PATH, encoding="UTF-8") as partitions_store:
+                runs = json.load(partitions_store)
+        except (FileNotFoundError, ValueError):
+            runs = {}
+
+        if self.run is None:
+            runs.pop(self.key, None)
+        else:
+            runs[self.key] = self.run
+        self.changed = False
+        self.last_save_time = time.monotonic()
+        try:
+            write_json_atomically(PARTITIONS_PATH, runs)
+        except OSError as exception:
+            self.logger.exception(
+                f"Error while saving the partitions to the path: {PARTITIONS_PATH}. Error: {exception}"
+            )
+
+    def resume(self):
+        """Resumes the interrupted run of this type, taking over its checkpoint time. Returns the
+        time ranges left to be fetched, or None if there is nothing to resume
+        """
+        run = self.load()
+        if not run or not isinstance(run.get("partitions"), list):
+            return None
+
+        date_ranges = []
+        with self.lock:
+            self.run = run
+            self.checkpoint_time = run["checkpoint_time"]
+            self.indexes = {}
+            self.blocks = {}
+            for index, partition in enumerate(run["partitions"]):
+                if not partition["done"]:
+                    # the sessions started at the last start time are fetched again, since a block may end
+                    # between sessions started at the same time. Their documents are indexed under their
+                    # public id, so they replace the indexed ones
+                    date_range = (partition["last_start_time"] or partition["start_time"], partition["end_time"])
+                    self.indexes[date_range] = index
+                    self.blocks[index] = self.new_partition_progress()
+                    date_ranges.append(date_range)
+
+        self.logger.info(
+            f"Resuming {len(date_ranges)} unfinished partitions out of {len(run['partitions'])} of the {self.key} "
+            f"sync started at {run['checkpoint_time']}. Remove {PARTITIONS_PATH} to start over."
+        )
+        return date_ranges
+
+    def start(self, partitions):
+        """Records the partitions of a new run
+        :param partitions: list of tuples of start time and end time, without duplicates
+        """
+        with self.lock:
+            self.run = {
+                "checkpoint_time": self.checkpoint_time,
+                "partitions": [
+                    {"start_time": start_time, "end_time": end_time, "last_start_time": None, "done": False}
+                    for start_time, end_time in partitions
+                ],
+            }
+            self.indexes = {tuple(date_range): index for index, date_range in enumerate(partitions)}
+            self.blocks = {index: self.new_partition_progress() for index in range(len(partitions))}
+            self.save()
+
+    @staticmethod
+    def new_partition_progress():
+        return {
+            "total_blocks": 0,
+            "indexed_blocks": 0,
+            "last_start_times": {},
+            "completed": set(),
+            "fetched": False,
+            "failed": False,
+        }
+
+    def add_block(self, date_range, last_start_time):
+        """Registers a block of documents of a partition sent to the queue. Returns the function to
+        call with True once the block is indexed, or False if it failed to be indexed
+        :param date_range: tuple of start time and end time of the partition, as returned by resume or given to start
+        :param last_start_time: start time of the last session of the block
+        """
+        with self.lock:
+            index = self.indexes[tuple(date_range)]
+            progress = self.blocks[index]
+            block = progress["total_blocks"]
+            progress["total_blocks"] += 1
+            progress["last_start_times"][block] = last_start_time
+
+        return lambda succeeded: self.acknowledge(index, block, succeeded)
+
+    def acknowledge(self, index, block, succeeded):
+        """Records that a block of a partition was indexed
+        :param index: index of the partition in the run
+        :param block: number of the block within the partition
+        :param succeeded: whether all the documents of the block were indexed
+        """
+        with self.lock:
+            progress = self.blocks[index]
+            if not succeeded:
+                # the partition is resumed from the last block before this one on the next run
+                progress["failed"] = True
+                return
+
+            progress["completed"].add(block)
+            last_start_time = None
+            while progress["indexed_blocks"] in progress["completed"]:
+                last_start_time = progress["last_start_times"].pop(progress["indexed_blocks"])
+                progress["completed"].discard(progress["indexed_blocks"])
+                progress["indexed_blocks"] += 1
+
+            if last_start_time:
+                self.run["partitions"][index]["last_start_time"] = last_start_time
+            self.complete_partition(index)
+
+    def finish_fetching(self, date_range, succeeded):
+        """Records that all the blocks of a partition were sent to the queue
+        :param date_range: tuple of start time and end time of the partition, as returned by resume or given to start
+        :param succeeded: whether the partition was fetched without errors
+        """
+        with self.lock:
+            index = self.indexes[tuple(date_range)]
+            progress = self.blocks[index]
+            progress["fetched"] = True
+            progress["failed"] = progress["failed"] or not succeeded
+            self.complete_partition(index)
+
+    def complete_partition(self, index):
+        """Marks the partition as done once it is fetched and all its blocks are indexed, and saves
+        the progress when the partition is done or the last write is older than save_interval.
+        Must be called with the lock held"""
+        progress = self.blocks[index]
+        self.changed = True
+        if progress["fetched"] and not progress["failed"] and \
+                progress["indexed_blocks"] == progress["total_blocks"]:
+            self.run["partitions"][index]["done"] = True
+            self.save()
+        elif time.monotonic() - self.last_save_time >= self.save_interval:
+            self.save()
+
+    def flush(self):
+        """Writes the progress recorded since the last write, once the producers and consumers stopped"""
+        with self.lock:
+            if self.changed and self.run is not None:
+                self.save()
+
+    def get_unfinished_partitions(self):
+        """Returns the start and end times of the partitions of the current run which are not complete"""
+        with self.lock:
+            if self.run is None:
+                return []
+            return [(partition["start_time"], partition["end_time"])
+                    for partition in self.run["partitions"] if not partition["done"]]
+
+    def clear(self):
+        """Forgets the partitions of the current run once it is complete. The partitions of an interrupted
+        run are kept when this run did not resume them, like a run syncing the changed sessions instead"""
+        with self.lock:
+            if self.run is None:
+                return
+            self.run = None
+            self.indexes = {}
+            self.blocks = {}
+            self.save()
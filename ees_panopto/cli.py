@@ -15,6 +15,7 @@ import os
 from argparse import ArgumentParser, BooleanOptionalAction
 
 from .bootstrap_command import BootstrapCommand
+from .click_count_sync_command import ClickCountSyncCommand
 from .deletion_sync_command import DeletionSyncCommand
 from .full_sync_command import FullSyncCommand
 from .incremental_sync_command import IncrementalSyncCommand
@@ -25,6 +26,7 @@ CMD_FULL_SYNC = 'full-sync'
 CMD_INCREMENTAL_SYNC = 'incremental-sync'
 CMD_DELETION_SYNC = 'deletion-sync'
 CMD_PERMISSION_SYNC = 'permission-sync'
+CMD_CLICK_COUNT_SYNC = 'click-count-sync'
 
 commands = {
     CMD_BOOTSTRAP: BootstrapCommand,
@@ -32,6 +34,7 @@ commands = {
     CMD_INCREMENTAL_SYNC: IncrementalSyncCommand,
     CMD_DELETION_SYNC: DeletionSyncCommand,
     CMD_PERMISSION_SYNC: PermissionSyncCommand,
+    CMD_CLICK_COUNT_SYNC: ClickCountSyncCommand,
 }
 
 
@@ -103,6 +106,7 @@ def _parser():
     subparsers.add_parser(CMD_INCREMENTAL_SYNC)
     subparsers.add_parser(CMD_DELETION_SYNC)
     subparsers.add_parser(CMD_PERMISSION_SYNC)
+    subparsers.add_parser(CMD_CLICK_COUNT_SYNC)
 
     return parser
 
@@ -0,0 +1,96 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""This module allows to refresh the click counts of the indexed videos.
+
+    It reads the click_log rows added since the last run and updates only the
+    click_count field of the matching documents, without fetching the videos
+    from Panopto again.
+"""
+from .base_command import BaseCommand
+from .checkpointing import Checkpoint
+from .constant import BATCH_SIZE, CONNECTION_TIMEOUT
+from .sync_panopto import video_url_template
+from .utils import get_current_time, split_documents_into_equal_chunks
+
+WATERMARK_TYPE = "click_log"
+
+# statuses of the failed updates which may succeed on the next run, like a conflict or an overloaded cluster
+RETRYABLE_STATUSES = {408, 409, 429}
+
+
+def is_retryable(error):
+    """Returns True if a failed update may succeed when it is sent again
+    :param error: failed item of a bulk response
+    """
+    status = list(error.values())[0].get('status')
+    return status is None or status in RETRYABLE_STATUSES or status >= 500
+
+
+class ClickCountSyncCommand(BaseCommand):
+    """This class start executions of the click count sync feature."""
+
+    def get_public_id(self, url):
+        """Returns the public id of the video of the url, or None if the url is not a video url
+        :param url: clicked url
+        """
+        video_url_prefix = video_url_template.format(
+            host=self.config.get_value("panopto.host_url"), public_id='')
+        if url and url.startswith(video_url_prefix):
+            return url[len(video_url_prefix):] or None
+        return None
+
+    def execute(self):
+        """This function execute the click count sync."""
+        config = self.config
+        logger = self.logger
+        checkpoint = Checkpoint(config, logger)
+        fsd_search_portal_client = self.fsd_search_portal_client
+
+        logger.info(f"Click count sync started at: {get_current_time()}")
+
+        watermark = checkpoint.get_watermark(WATERMARK_TYPE) or 0
+        urls, last_id = fsd_search_portal_client.get_click_log_changes(watermark)
+        logger.info(f"Found {len(urls)} urls clicked since the click_log id {watermark}")
+
+        urls = [url for url in urls if self.get_public_id(url)]
+        click_counts = fsd_search_portal_client.count_clicks(urls)
+
+        total_documents_updated = 0
+        total_documents_skipped = 0
+        total_documents_failed = 0
+        total_documents_to_retry = 0
+        for url_batch in split_documents_into_equal_chunks(urls, BATCH_SIZE):
+            documents_updated, documents_skipped, errors = self.elastic_search_custom_client.update_click_counts(
+                {self.get_public_id(url): click_counts[url] for url in url_batch},
+                CONNECTION_TIMEOUT,
+            )
+            total_documents_updated += documents_updated
+            total_documents_skipped += documents_skipped
+            total_documents_failed += len(errors)
+            total_documents_to_retry += sum(1 for error in errors if is_retryable(error))
+
+            for error in errors:
+                logger.error(f"Error while updating the click count. Error: {error}")
+
+        self.elastic_search_custom_client.save_id_map()
+        # the clicks of the updates which may succeed later are counted again on the next run. The documents
+        # not found in the index and the updates rejected by the index would block the watermark for good
+        if total_documents_to_retry:
+            logger.warning(
+                f"{total_documents_to_retry} click counts were not updated. Click log watermark not saved")
+        else:
+            checkpoint.set_watermark(last_id, WATERMARK_TYPE)
+        logger.info(f"Click count sync ended at: {get_current_time()}")
+        self.close_connection_pools()
+
+        output = {
+            'total_urls_found': len(urls),
+            'total_documents_updated': total_documents_updated,
+            'total_documents_skipped': total_documents_skipped,
+            'total_documents_failed': total_documents_failed
+        }
+
+        return output
@@ -9,6 +9,7 @@
     the settings of the Network Drives Server connector.
 """
 import json
+import logging
 
 import pymysql
 import pymysql.cursors
@@ -17,8 +18,10 @@ from cerberus import Validator
 from yaml.error import YAMLError
 
 from .constant import RFC_3339_DATETIME_FORMAT
+from .extraction_cache import ExtractionCache, set_default_cache
 from .fsd_search_portal_client import FsdSearchPortalClient
 from .schema import schema
+from .tika_client import TikaClient, set_default_client
 
 
 class ConfigurationInvalidException(Exception):
@@ -58,6 +61,8 @@ class Configuration:
         self.__configurations = {}
         self.file_name = file_name
         self.fsd_search_portal_client = None
+        self.tika_client = None
+        self.extraction_cache = None
         try:
             with open(file_name, encoding='utf-8') as stream:
                 self.__configurations = yaml.safe_load(stream)
@@ -78,6 +83,8 @@ class Configuration:
                 value)
 
         self.create_fsd_search_portal_client()
+        self.create_tika_client()
+        self.create_extraction_cache()
 
         if read_from_db:
             if self.__configurations["include"]["ocr_path_template"]:
@@ -101,8 +108,38 @@ class Configuration:
             username = self.get_value('fsd_search_db.username')
             password = self.get_value('fsd_search_db.password')
 
+            # the producer threads share the client with the main thread
+            max_size = self.get_value('connection_pool.max_size') or \
+                self.get_value('panopto_sync_thread_count') + 1
+
             self.fsd_search_portal_client = FsdSearchPortalClient(
-                host, database, username, password)
+                host, database, username, password,
+                min_size=self.get_value('connection_pool.min_size'),
+                max_size=max_size,
+                idle_timeout=self.get_value('connection_pool.idle_timeout'),
+                wait_timeout=self.get_value('connection_pool.wait_timeout'))
+
+    def create_tika_client(self):
+        if self.tika_client is None:
+            self.tika_client = TikaClient(
+                logging.getLogger(__name__),
+                endpoints=self.get_value('tika.endpoints'),
+                max_concurrency=self.get_value('tika.max_concurrency'),
+                timeout=self.get_value('tika.timeout'),
+                health_check_interval=self.get_value('tika.health_check_interval'),
+                pdf_min_page_text_length=self.get_value('tika.pdf_min_page_text_length'),
+                pdf_ocr_workers=self.get_value('tika.pdf_ocr_workers'))
+            # the text extraction functions of the utils module send the files to these servers
+            set_default_client(self.tika_client)
+
+    def create_extraction_cache(self):
+        if self.extraction_cache is None and self.get_value('extraction_cache.enabled'):
+            cache_options = {'max_bytes': self.get_value('extraction_cache.max_bytes')}
+            if self.get_value('extraction_cache.path'):
+                cache_options['path'] = self.get_value('extraction_cache.path')
+            self.extraction_cache = ExtractionCache(logging.getLogger(__name__), **cache_options)
+            # run_tika and the LeadTools OCR read the texts of the unchanged files from this cache
+            set_default_cache(self.extraction_cache)
 
     def validate(self):
         """Validates each properties defined in the yaml configuration file
@@ -0,0 +1,224 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""connection_pool module allows to share connections between the threads of the connector.
+
+    Connections are created on demand up to a maximum size, handed out to one thread
+    at a time, checked before being reused and closed after being idle for too long.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ConnectionPoolTimeoutException(Exception):
+    """Exception raised when no connection was released before the wait timeout.
+
+    Attributes:
+        name -- name of the pool
+        wait_timeout -- seconds waited for a connection
+    """
+
+    def __init__(self, name, wait_timeout):
+        super().__init__(
+            f"No connection of the {name} pool was available after {wait_timeout} seconds.")
+        self.name = name
+        self.wait_timeout = wait_timeout
+
+
+class ConnectionPool:
+    """This class keeps a bounded set of connections that threads acquire and release."""
+
+    def __init__(
+        self,
+        name,
+        logger,
+        create_connection,
+        close_connection=None,
+        is_healthy=None,
+        min_size=1,
+        max_size=10,
+        idle_timeout=300,
+        health_check_interval=30,
+        wait_timeout=None,
+    ):
+        """
+        :param name: name of the pool used in the logs
+        :param logger: logger object
+        :param create_connection: function creating a new connection
+        :param close_connection: function closing a connection, defaults to calling its close method
+        :param is_healthy: function returning False if a connection can not be used anymore
+        :param min_size: number of idle connections never evicted
+        :param max_size: maximum number of connections open at the same time
+        :param idle_timeout: seconds after which an idle connection above min_size is closed
+        :param health_check_interval: seconds of idleness after which a connection is checked before reuse
+        :param wait_timeout: maximum seconds to wait for a connection, None to wait forever
+        """
+        self.name = name
+        self.logger = logger
+        self.create_connection = create_connection
+        self.close_connection = close_connection or (lambda connection: connection.close())
+        self.is_healthy = is_healthy
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.wait_timeout = wait_timeout
+
+        self._condition = threading.Condition()
+        # idle connections with the time they were released, the most recent last
+        self._idle_connections = []
+        self._size = 0
+
+        self.total_acquired = 0
+        self.total_created = 0
+        self.total_closed = 0
+        self.total_waits = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self):
+        """Returns a connection for the exclusive use of the calling thread, creating it if
+        the pool is not full, or waiting for another thread to release one otherwise"""
+        start_time = time.monotonic()
+        connection = None
+        released_at = None
+        with self._condition:
+            while True:
+                self._evict_idle_connections()
+                if self._idle_connections:
+                    connection, released_at = self._idle_connections.pop()
+                    break
+                if self._size < self.max_size:
+                    # reserve the slot, the connection is created outside of the lock
+                    self._size += 1
+                    break
+
+                remaining = None
+                if self.wait_timeout is not None:
+                    remaining = self.wait_timeout - (time.monotonic() - start_time)
+                    if remaining <= 0:
+                        raise ConnectionPoolTimeoutException(self.name, self.wait_timeout)
+                self._condition.wait(remaining)
+
+            wait_time = time.monotonic() - start_time
+            self.total_acquired += 1
+            if wait_time > 0.001:
+                self.total_waits += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        if connection is not None and self.is_healthy and \
+                time.monotonic() - released_at >= self.health_check_interval:
+            if not self._check_health(connection):
+                self.logger.info(f"Replacing an unhealthy connection of the {self.name} pool")
+                self._close(connection)
+                connection = None
+
+        if connection is None:
+            connection = self._create()
+        return connection
+
+    def release(self, connection, discard=False):
+        """Gives a connection back to the pool
+        :param connection: connection returned by acquire
+        :param discard: close the connection instead of keeping it, for broken connections
+        """
+        if discard:
+            self._close(connection)
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            return
+
+        with self._condition:
+            self._idle_connections.append((connection, time.monotonic()))
+            self._evict_idle_connections()
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager acquiring a connection and releasing it when the block exits. The connection
+        is closed instead of being released if the block raised, as it may be broken"""
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def close_all(self):
+        """Closes the idle connections of the pool"""
+        with self._condition:
+            idle_connections = self._idle_connections
+            self._idle_connections = []
+            self._size -= len(idle_connections)
+            self._condition.notify_all()
+
+        for connection, _ in idle_connections:
+            self._close(connection)
+
+    def get_stats(self):
+        """Returns the size and the wait time metrics of the pool"""
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle_connections),
+                'in_use': self._size - len(self._idle_connections),
+                'total_acquired': self.total_acquired,
+                'total_created': self.total_created,
+                'total_closed': self.total_closed,
+                'total_waits': self.total_waits,
+                'total_wait_time': round(self.total_wait_time, 3),
+                'max_wait_time': round(self.max_wait_time, 3),
+            }
+
+    def _create(self):
+        try:
+            connection = self.create_connection()
+            if connection is None:
+                raise Exception(f"Connection of the {self.name} pool is not established.")
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self.total_created += 1
+        return connection
+
+    def _close(self, connection):
+        try:
+            self.close_connection(connection)
+        except Exception as exception:
+            self.logger.debug(f"Error while closing a connection of the {self.name} pool. Error: {exception}")
+        with self._condition:
+            self.total_closed += 1
+
+    def _check_health(self, connection):
+        try:
+            return self.is_healthy(connection) is not False
+        except Exception:
+            return False
+
+    def _evict_idle_connections(self):
+        """Closes the connections idle for longer than idle_timeout, keeping min_size of them.
+        Must be called with the lock held"""
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic()
+        # the oldest connections are at the beginning of the list
+        while len(self._idle_connections) > self.min_size and \
+                now - self._idle_connections[0][1] >= self.idle_timeout:
+            connection, _ = self._idle_connections.pop(0)
+            self._size -= 1
+            try:
+                self.close_connection(connection)
+            except Exception as exception:
+                self.logger.debug(
+                    f"Error while closing a connection of the {self.name} pool. Error: {exception}")
+            self.total_closed += 1
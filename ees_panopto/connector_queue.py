@@ -3,18 +3,115 @@
 # or more contributor license agreements. Licensed under the Elastic License 2.0;
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
-import multiprocessing
-from multiprocessing.queues import Queue
 import threading
+import time
+from collections import deque
 
 
-class ConnectorQueue(Queue):
-    """Class to support additional queue operations specific to the connector"""
+def estimate_size(documents):
+    """Returns the approximate size in bytes of a list of documents, counting the length of their values
+    :param documents: list of documents
+    """
+    size = 0
+    for document in documents:
+        for value in document.values():
+            size += len(value) if isinstance(value, (str, bytes, list)) else 8
+    return size
 
-    def __init__(self, logger):
-        ctx = multiprocessing.get_context()
+
+class ConnectorQueue:
+    """Class to support additional queue operations specific to the connector.
+
+    The producer and consumer threads run in the same process, so the items are passed as is,
+    without being serialized. The queue holds at most max_size items and about max_bytes bytes
+    of documents, and blocks the producers until the consumers catch up when it is full."""
+
+    def __init__(self, logger, max_size=0, max_bytes=0):
+        """
+        :param logger: logger object
+        :param max_size: maximum number of items in the queue, 0 for no limit
+        :param max_bytes: approximate maximum size of the documents in the queue, 0 for no limit
+        """
         self.logger = logger
-        super(ConnectorQueue, self).__init__(ctx=ctx)
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+
+        self._items = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self.total_put = 0
+        self.max_depth = 0
+        self.max_depth_bytes = 0
+        self.total_put_waits = 0
+        self.total_put_wait_time = 0.0
+        self.total_get_waits = 0
+        self.total_get_wait_time = 0.0
+
+    def _is_full(self, size):
+        # an item larger than max_bytes is still accepted once the queue is empty
+        if not self._items:
+            return False
+        if self.max_size and len(self._items) >= self.max_size:
+            return True
+        return bool(self.max_bytes) and self._bytes + size > self.max_bytes
+
+    def put(self, item, size=0):
+        """Add an item to the queue, waiting while the queue is full
+        :param item: item to be added
+        :param size: approximate size of the item in bytes
+        """
+        with self._not_full:
+            if self._is_full(size):
+                start_time = time.monotonic()
+                while self._is_full(size):
+                    self._not_full.wait()
+                self.total_put_waits += 1
+                self.total_put_wait_time += time.monotonic() - start_time
+
+            self._items.append((item, size))
+            self._bytes += size
+            self.total_put += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self.max_depth_bytes = max(self.max_depth_bytes, self._bytes)
+            self._not_empty.notify()
+
+    def get(self):
+        """Remove and return an item from the queue, waiting while the queue is empty"""
+        with self._not_empty:
+            if not self._items:
+                start_time = time.monotonic()
+                while not self._items:
+                    self._not_empty.wait()
+                self.total_get_waits += 1
+                self.total_get_wait_time += time.monotonic() - start_time
+
+            item, size = self._items.popleft()
+            self._bytes -= size
+            self._not_full.notify()
+            return item
+
+    def qsize(self):
+        """Returns the number of items in the queue"""
+        with self._lock:
+            return len(self._items)
+
+    def get_stats(self):
+        """Returns the depth and the wait time statistics of the queue"""
+        with self._lock:
+            return {
+                'depth': len(self._items),
+                'depth_bytes': self._bytes,
+                'max_depth': self.max_depth,
+                'max_depth_bytes': self.max_depth_bytes,
+                'total_put': self.total_put,
+                'total_put_waits': self.total_put_waits,
+                'total_put_wait_time': round(self.total_put_wait_time, 3),
+                'total_get_waits': self.total_get_waits,
+                'total_get_wait_time': round(self.total_get_wait_time, 3),
+            }
 
     def end_signal(self):
         """Send an terminate signal to indicate the queue can be closed"""
@@ -22,12 +119,24 @@ class ConnectorQueue(Queue):
         signal_close = {"type": "signal_close"}
         self.put(signal_close)
 
-    def append_to_queue(self, documents):
+    def append_to_queue(self, documents, acknowledge=None):
         """Append documents to the shared queue
         :param documents: documents fetched from sharepoint
+        :param acknowledge: function called by the consumer with True once the documents are indexed,
+            or False if they failed to be indexed
         """
         if documents:
-            documents_map = {"type": "document_list", "data": documents}
+            documents_map = {"type": "document_list", "data": documents, "acknowledge": acknowledge}
             self.logger.debug(f"Thread ID {threading.get_ident()} added list of {len(documents)} \
                 documents into the queue ")
-            self.put(documents_map)
+            self.put(documents_map, estimate_size(documents))
+        elif acknowledge:
+            # nothing to index
+            acknowledge(True)
+
+    def append_delete_list(self, ids):
+        """Append ids of documents to be deleted to the shared queue
+        :param ids: ids of the documents
+        """
+        if ids:
+            self.put({"type": "delete_list", "data": ids}, sum(len(item_id) for item_id in ids))
@@ -8,10 +8,82 @@
     Documents that were deleted in Network Drives will still be available in
     Elastic Enterprise Search until a full sync happens, or until this module is used.
 """
-import os
+import uuid
+from bisect import bisect_left
 
-from . import constant
 from .base_command import BaseCommand
+from .constant import BATCH_SIZE, CONNECTION_TIMEOUT
+from .sync_elastic_search import delete_indexed_documents
+from .sync_panopto import query_live_public_ids
+from .utils import get_current_time
+
+UUID_SIZE = 16
+
+
+class SortedIdSet:
+    """This class keeps a large set of uuids in a compact form, as the 16 bytes of each uuid
+    in a single sorted bytearray, and looks them up with a binary search."""
+
+    class Keys:
+        """Sequence view of the uuids of the bytearray, for the bisect module"""
+
+        def __init__(self, data):
+            self.data = data
+
+        def __len__(self):
+            return len(self.data) // UUID_SIZE
+
+        def __getitem__(self, index):
+            return bytes(self.data[index * UUID_SIZE:(index + 1) * UUID_SIZE])
+
+    def __init__(self):
+        self.data = bytearray()
+        self.is_sorted = True
+        self.last_key = b''
+
+    @staticmethod
+    def get_key(item_id):
+        """Returns the bytes of an id, or None if the id is not a uuid
+        :param item_id: uuid as a string
+        """
+        try:
+            return uuid.UUID(str(item_id)).bytes_le
+        except ValueError:
+            return None
+
+    def add(self, item_id):
+        """Adds an id to the set. Ids added in sorted order are only appended
+        :param item_id: uuid as a string
+        """
+        key = self.get_key(item_id)
+        if key is None:
+            return
+        if key < self.last_key:
+            self.is_sorted = False
+        self.last_key = key
+        self.data += key
+
+    def freeze(self):
+        """Sorts the ids if they were not added in order. Must be called before any lookup"""
+        if not self.is_sorted:
+            keys = {bytes(self.data[start:start + UUID_SIZE]) for start in range(0, len(self.data), UUID_SIZE)}
+            self.data = bytearray(b''.join(sorted(keys)))
+            self.is_sorted = True
+
+    def __len__(self):
+        return len(self.data) // UUID_SIZE
+
+    def __iter__(self):
+        for start in range(0, len(self.data), UUID_SIZE):
+            yield str(uuid.UUID(bytes_le=bytes(self.data[start:start + UUID_SIZE])))
+
+    def __contains__(self, item_id):
+        key = self.get_key(item_id)
+        if key is None:
+            return False
+        keys = self.Keys(self.data)
+        index = bisect_left(keys, key)
+        return index < len(keys) and keys[index] == key
 
 
 class DeletionSyncCommand(BaseCommand):
@@ -24,8 +96,90 @@ class DeletionSyncCommand(BaseCommand):
         super().__init__(args)
         self.logger.debug("Initializing the deletion sync class")
 
+    def fetch_live_ids(self):
+        """Returns the set of the public ids of the videos which still exist and are public in Panopto"""
+        live_ids = SortedIdSet()
+        with self.mssql_client.connection() as conn:
+            batches = self.mssql_client.execute_query(
+                conn, query_live_public_ids, fetch_method='fetchmany',
+                size=self.config.get_value("panopto_db.fetch_batch_size"))
+            for batch in batches:
+                for row in batch:
+                    live_ids.add(row.publicID)
+
+        live_ids.freeze()
+        self.logger.info(f"Found {len(live_ids)} live videos in Panopto")
+        return live_ids
+
+    def delete_documents(self, documents):
+        """Deletes a batch of documents from the index and from the local stores
+        :param documents: dictionary of document id and Elasticsearch _id
+        Returns:
+            total_documents_deleted: number of deleted documents
+            errors: list of failed deletions
+        """
+        documents_deleted, errors = delete_indexed_documents(
+            self.elastic_search_custom_client, documents, CONNECTION_TIMEOUT, self.local_storage,
+            self.fingerprint_store)
+
+        for error in errors:
+            self.logger.error(f"Error while deleting the document. Error: {error}")
+        return documents_deleted, errors
+
     def execute(self):
-        """Run the command.
-        This method is overridden by actual commands with logic
-        that is specific to each command implementing it."""
-        raise NotImplementedError
\ No newline at end of file
+        """Runs the deletion sync. The ids of the indexed documents are streamed from the index and
+        looked up in the set of the live public ids, and the missing ones are deleted in batches"""
+        logger = self.logger
+        logger.info(f"Deletion sync started at: {get_current_time()}")
+
+        live_ids = self.fetch_live_ids()
+        if not live_ids:
+            # an empty result is more likely a failure or a wrong database than every video being deleted
+            logger.error("No live videos found in Panopto, skipping the deletion of the indexed documents")
+            self.close_connection_pools()
+            return {'total_documents_found': 0, 'total_documents_deleted': 0, 'total_documents_failed': 0}
+
+        total_documents_found = 0
+        total_documents_deleted = 0
+        total_documents_failed = 0
+        documents_to_delete = {}
+        for item_id, document_id in self.elastic_search_custom_client.scan_document_ids('training'):
+            total_documents_found += 1
+            # documents whose id is not a uuid were not indexed from Panopto videos
+            if item_id is None or SortedIdSet.get_key(item_id) is None or item_id in live_ids:
+                continue
+
+            documents_to_delete[item_id] = document_id
+            if len(documents_to_delete) >= BATCH_SIZE:
+                documents_deleted, errors = self.delete_documents(documents_to_delete)
+                total_documents_deleted += documents_deleted
+                total_documents_failed += len(errors)
+                documents_to_delete = {}
+
+        if documents_to_delete:
+            documents_deleted, errors = self.delete_documents(documents_to_delete)
+            total_documents_deleted += documents_deleted
+            total_documents_failed += len(errors)
+
+        # The ids of the deleted documents were removed from the local ids storage with them. The stored ids
+        # of the videos which are gone but were not found in the index are removed as well, so the incremental
+        # sync does not send their deletion again
+        missing_ids = self.local_storage.get_missing_ids("videos", live_ids)
+        if missing_ids:
+            self.local_storage.delete_ids("videos", missing_ids)
+            logger.info(f"Removed {len(missing_ids)} ids of deleted videos from the local ids storage")
+
+        self.elastic_search_custom_client.save_id_map()
+        if self.fingerprint_store:
+            self.fingerprint_store.save()
+
+        logger.info(f"Deletion sync ended at: {get_current_time()}")
+        self.close_connection_pools()
+
+        output = {
+            'total_documents_found': total_documents_found,
+            'total_documents_deleted': total_documents_deleted,
+            'total_documents_failed': total_documents_failed
+        }
+
+        return output
@@ -5,9 +5,15 @@
 #
 """This module perform operations related to Enterprise Search based on the Enterprise Search version
 """
+import json
+import os
+import threading
+
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import BulkIndexError, bulk, scan, streaming_bulk
 
+ID_MAP_PATH = os.path.join(os.path.dirname(__file__), 'es_id_map.json')
+
 
 class ElasticSearchWrapper:
     """This class contains operations related to Enterprise Search such as index documents, delete documents, etc."""
@@ -35,6 +41,86 @@ class ElasticSearchWrapper:
         )
         self.retry_count = int(config.get_value("retry_count"))
 
+        # Cache of the document ids and their Elasticsearch _id, None until it is loaded or built
+        self.id_map_lock = threading.Lock()
+        self.id_map_changed = False
+        self.id_map = self.load_id_map()
+
+    def load_id_map(self):
+        """Loads the cached _ids of the documents of the index from the id map file"""
+        try:
+            with open(ID_MAP_PATH, encoding='utf-8') as id_map_file:
+                id_map = json.load(id_map_file).get(self.source)
+        except FileNotFoundError:
+            self.logger.debug(f"Id map file not found on path: {ID_MAP_PATH}")
+            return None
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while parsing the id map file from path: {ID_MAP_PATH}. Error: {exception}")
+            return None
+
+        if id_map is not None:
+            self.logger.info(f"Loaded {len(id_map)} cached document ids of the index {self.source}")
+        return id_map
+
+    def build_id_map(self):
+        """Builds the id map with a scan of the index fetching only the id of the documents"""
+        self.logger.info(f"Building the id map of the index {self.source}")
+        results = scan(
+            self.elastic_search_client,
+            index=self.source,
+            query={"query": {"match_all": {}}, "_source": ["id"]},
+            size=1000
+        )
+
+        id_map = {}
+        for item in results:
+            item_id = item['_source'].get('id')
+            if item_id:
+                id_map[item_id] = item['_id']
+        return id_map
+
+    def save_id_map(self):
+        """Writes the id map to the id map file if it changed, keeping the maps of the other indices"""
+        with self.id_map_lock:
+            if self.id_map is None or not self.id_map_changed:
+                return
+            id_map = dict(self.id_map)
+            self.id_map_changed = False
+
+        try:
+            with open(ID_MAP_PATH, encoding='utf-8') as id_map_file:
+                id_maps = json.load(id_map_file)
+        except (FileNotFoundError, ValueError):
+            id_maps = {}
+        id_maps[self.source] = id_map
+
+        # written to a temporary file first, so an interrupted run does not leave a truncated map
+        temporary_path = ID_MAP_PATH + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as id_map_file:
+            json.dump(id_maps, id_map_file)
+        os.replace(temporary_path, ID_MAP_PATH)
+        self.logger.info(f"Saved {len(id_map)} cached document ids of the index {self.source}")
+
+    def remember_document_ids(self, document_ids):
+        """Adds document ids and their _id to the id map
+        :param document_ids: dictionary of document id and Elasticsearch _id
+        """
+        with self.id_map_lock:
+            if self.id_map is not None and document_ids:
+                self.id_map.update(document_ids)
+                self.id_map_changed = True
+
+    def forget_document_ids(self, ids):
+        """Removes document ids from the id map
+        :param ids: list of document ids
+        """
+        with self.id_map_lock:
+            if self.id_map is not None:
+                for item_id in ids:
+                    if self.id_map.pop(item_id, None) is not None:
+                        self.id_map_changed = True
+
     def add_permissions(self, user_name, permission_list):
         raise Exception("Not Implemented")
 
@@ -47,8 +133,38 @@ class ElasticSearchWrapper:
     def create_content_source(self, schema, display, name, is_searchable):
         raise Exception("Not Implemented")
 
-    def delete_documents(self, document_ids):
-        raise Exception("Not Implemented")
+    def delete_documents(self, document_ids, timeout=None):
+        """Deletes documents from the index with bulk delete actions
+        :param document_ids: list of Elasticsearch _id of the documents to be deleted
+        :param timeout: Timeout in seconds
+        Returns:
+            total_documents_deleted: number of deleted documents
+            errors: list of failed deletions
+        """
+        total_documents_deleted = 0
+        errors = []
+        actions = ({'_op_type': 'delete', '_id': document_id} for document_id in document_ids)
+
+        for ok, item in streaming_bulk(
+            self.elastic_search_client,
+            actions=actions,
+            index=self.source,
+            max_retries=self.retry_count,
+            request_timeout=timeout,
+            raise_on_error=False,
+            yield_ok=True,
+        ):
+            # a document which is already gone does not need to be deleted
+            if ok or item['delete'].get('status') == 404:
+                total_documents_deleted += 1
+            else:
+                errors.append(item)
+
+        return total_documents_deleted, errors
+
+    def count_documents(self):
+        """Returns the number of documents in the index"""
+        return self.elastic_search_client.count(index=self.source)['count']
 
     def get_all_documents(self):
         query = {
@@ -67,57 +183,225 @@ class ElasticSearchWrapper:
 
         return results
 
+    def scan_document_ids(self, source=None):
+        """Yields the id and the Elasticsearch _id of the indexed documents, fetching only their id field
+        :param source: only scan the documents of this source, like training
+        """
+        query = {"query": {"match_all": {}}, "_source": ["id"]}
+        if source:
+            # The source field may be mapped either as a keyword or as a text with a keyword sub-field
+            query["query"] = {
+                "bool": {
+                    "should": [
+                        {"term": {"source": source}},
+                        {"term": {"source.keyword": source}},
+                    ],
+                    "minimum_should_match": 1
+                }
+            }
+        results = scan(
+            self.elastic_search_client,
+            index=self.source,
+            query=query,
+            size=1000
+        )
+
+        for item in results:
+            yield item['_source'].get('id'), item['_id']
+
+    def get_document_ids(self, ids):
+        """Returns the Elasticsearch _id of the indexed documents having one of the given ids.
+        The ids are looked up in the id map first, and only the missing ones are searched in the index
+        :param ids: list of document ids
+        Returns:
+            document_ids: dictionary of document id and Elasticsearch _id
+        """
+        with self.id_map_lock:
+            if self.id_map is None:
+                self.id_map = self.build_id_map()
+                self.id_map_changed = True
+
+            document_ids = {item_id: self.id_map[item_id] for item_id in ids if item_id in self.id_map}
+
+        missing_ids = [item_id for item_id in dict.fromkeys(ids) if item_id not in document_ids]
+        if missing_ids:
+            # documents indexed by a full sync get a random _id which is not in the map yet
+            found_ids = self.search_document_ids(missing_ids)
+            self.remember_document_ids(found_ids)
+            document_ids.update(found_ids)
+
+        return document_ids
+
+    def search_document_ids(self, ids):
+        """Searches the Elasticsearch _id of the indexed documents having one of the given ids
+        :param ids: list of document ids
+        Returns:
+            document_ids: dictionary of document id and Elasticsearch _id
+        """
+        # The id field may be mapped either as a keyword or as a text with a keyword sub-field
+        query = {
+            "query": {
+                "bool": {
+                    "should": [
+                        {"terms": {"id": ids}},
+                        {"terms": {"id.keyword": ids}},
+                    ]
+                }
+            },
+            "_source": ["id"]
+        }
+        results = scan(
+            self.elastic_search_client,
+            index=self.source,
+            query=query,
+            size=1000
+        )
+
+        wanted_ids = set(ids)
+        document_ids = {}
+        for item in results:
+            item_id = item['_source'].get('id')
+            if item_id in wanted_ids:
+                document_ids[item_id] = item['_id']
+
+        return document_ids
+
+    def update_click_counts(self, click_counts, timeout):
+        """Updates only the click_count field of the indexed documents. The documents whose cached _id
+        is no longer in the index are searched again, and their update is retried once
+        :param click_counts: dictionary of document id and click count
+        :param timeout: Timeout in seconds
+        Returns:
+            total_documents_updated: number of updated documents
+            total_documents_skipped: number of documents not found in the index
+            errors: list of failed updates
+        """
+        document_ids = self.get_document_ids(list(click_counts))
+        total_documents_updated, stale_ids, errors = self.send_click_counts(click_counts, document_ids, timeout)
+
+        if stale_ids:
+            # the documents deleted or indexed again under another _id since their _id was cached
+            self.forget_document_ids(stale_ids)
+            found_ids = self.search_document_ids(stale_ids)
+            self.remember_document_ids(found_ids)
+            documents_updated, stale_ids, retry_errors = self.send_click_counts(click_counts, found_ids, timeout)
+            total_documents_updated += documents_updated
+            errors.extend(retry_errors)
+            self.forget_document_ids(stale_ids)
+
+        total_documents_skipped = len(click_counts) - total_documents_updated - len(errors)
+        return total_documents_updated, total_documents_skipped, errors
+
+    def send_click_counts(self, click_counts, document_ids, timeout):
+        """Sends the click_count updates of the documents with bulk update actions
+        :param click_counts: dictionary of document id and click count
+        :param document_ids: dictionary of document id and Elasticsearch _id of the documents to update
+        :param timeout: Timeout in seconds
+        Returns:
+            total_documents_updated: number of updated documents
+            stale_ids: ids of the documents whose _id was not found in the index
+            errors: list of failed updates
+        """
+        total_documents_updated = 0
+        stale_ids = []
+        errors = []
+
+        ids_by_document_id = {document_id: item_id for item_id, document_id in document_ids.items()}
+        actions = [
+            {
+                '_op_type': 'update',
+                '_id': document_id,
+                'retry_on_conflict': self.retry_count,
+                'doc': {'click_count': click_counts[item_id]},
+            }
+            for item_id, document_id in document_ids.items()
+        ]
+
+        for ok, item in streaming_bulk(
+            self.elastic_search_client,
+            actions=actions,
+            index=self.source,
+            max_retries=self.retry_count,
+            request_timeout=timeout,
+            raise_on_error=False,
+            yield_ok=True,
+            ignore_status=(),
+        ):
+            if ok:
+                total_documents_updated += 1
+            elif item['update'].get('status') == 404:
+                stale_ids.append(ids_by_document_id[item['update'].get('_id')])
+            else:
+                errors.append(item)
+
+        return total_documents_updated, stale_ids, errors
+
     def index_documents_incremental(self, documents, timeout):
         try:
             total_documents_appended = 0
             total_documents_updated = 0
             errors = []
 
-            # Fetch all documents using the scan helper
-            results = self.get_all_documents()
-
-            fetched_documents = {}
-            for item in results:
-                item_id = item['_source']['id']
-                fetched_documents[item_id] = {
-                    '_op_type': 'update',
-                    '_id': item['_id'],
-                }
+            # Only the documents of the batch are looked up, instead of scanning the whole index
+            document_ids = self.get_document_ids([item['id'] for item in documents])
 
+            # documents of the batch by the _id of their action, to read the bulk responses
+            items_by_document_id = {}
             documents_to_update = []
             documents_to_insert = []
             for item in documents:
                 item_id = item['id']
-                if item_id in fetched_documents:
-                    merged_item = {
-                        **fetched_documents[item_id],
+                if item_id in document_ids:
+                    documents_to_update.append({
+                        '_op_type': 'update',
+                        '_id': document_ids[item_id],
+                        'retry_on_conflict': self.retry_count,
                         'doc': item
-                    }  # Merge the dictionaries
-                    documents_to_update.append(merged_item)
+                    })
+                    items_by_document_id[document_ids[item_id]] = item
                 else:
-                    documents_to_insert.append(item)
+                    # New documents use their public id as _id, so later runs update them in place
+                    documents_to_insert.append({**item, '_id': item['public_id']})
+                    items_by_document_id[item['public_id']] = item
 
             documents = documents_to_update + documents_to_insert
 
-            for ok, item in streaming_bulk(
-                self.elastic_search_client,
-                actions=documents,
-                index=self.source,
-                max_retries=self.retry_count,
-                request_timeout=timeout,
-                raise_on_error=False,
-                yield_ok=True,
-                ignore_status=(),
-            ):
-                operation_type = list(item.keys())[0]
-
-                if not ok:
-                    errors.append(item)
-                else:
-                    if operation_type == 'index':
-                        total_documents_appended += 1
-                    elif operation_type == 'update':
-                        total_documents_updated += 1
+            while documents:
+                indexed_ids = {}
+                stale_items = []
+                for ok, item in streaming_bulk(
+                    self.elastic_search_client,
+                    actions=documents,
+                    index=self.source,
+                    max_retries=self.retry_count,
+                    request_timeout=timeout,
+                    raise_on_error=False,
+                    yield_ok=True,
+                    ignore_status=(),
+                ):
+                    operation_type = list(item.keys())[0]
+                    document_id = item[operation_type].get('_id')
+
+                    if not ok:
+                        if operation_type == 'update' and item[operation_type].get('status') == 404:
+                            stale_items.append(items_by_document_id[document_id])
+                        else:
+                            errors.append(item)
+                    else:
+                        indexed_ids[items_by_document_id[document_id]['id']] = document_id
+                        if operation_type == 'index':
+                            total_documents_appended += 1
+                        elif operation_type == 'update':
+                            total_documents_updated += 1
+
+                self.remember_document_ids(indexed_ids)
+
+                # The documents deleted since their _id was cached are indexed again under their public id
+                self.forget_document_ids([item['id'] for item in stale_items])
+                documents = []
+                for item in stale_items:
+                    documents.append({**item, '_id': item['public_id']})
+                    items_by_document_id[item['public_id']] = item
 
             return total_documents_appended, total_documents_updated, errors
         except Exception as exception:
@@ -132,10 +416,12 @@ class ElasticSearchWrapper:
         :param timeout: Timeout in seconds
         """
         try:
+            # The documents use their public id as _id, so the sessions fetched again when an
+            # interrupted partition is resumed replace their documents instead of duplicating them
             # raise_on_error: DO NOT raise BulkIndexError
             responses = bulk(
                 self.elastic_search_client,
-                actions=documents,
+                actions=({**document, '_id': document['public_id']} for document in documents),
                 index=self.source,
                 max_retries=self.retry_count,
                 request_timeout=timeout,
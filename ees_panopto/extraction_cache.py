@@ -0,0 +1,199 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""extraction_cache module allows to skip the OCR and the text extraction of the files already read.
+
+    The extracted text of a file is kept on disk under the SHA-256 hash of its content, of the
+    engine and of the language used, so the same content is only read once whatever its path.
+    The least recently used texts are removed once the cache grows over its maximum size.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# kept outside of the package, so that reinstalling the connector does not drop the cached texts
+EXTRACTION_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'ees_panopto', 'extraction_cache')
+
+# size of the blocks read to hash a file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ExtractionCache:
+    """This class keeps the extracted texts in files named after their key, in folders named
+    after the first two characters of the key. The modification time of a file is its last use."""
+
+    def __init__(self, logger, path=EXTRACTION_CACHE_PATH, max_bytes=1024 * 1024 * 1024):
+        """
+        :param logger: logger object
+        :param path: folder of the cache
+        :param max_bytes: maximum size of the texts in the cache
+        """
+        self.logger = logger
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # size of the entries by key, the least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        self.total_hits = 0
+        self.total_misses = 0
+        self.total_stored = 0
+        self.total_evicted = 0
+        self.load()
+
+    @staticmethod
+    def get_key(content, engine, language=None):
+        """Returns the key of a content extracted by an engine
+        :param content: content of the file
+        :param engine: name of the engine extracting the text
+        :param language: languages of the OCR
+        """
+        key = hashlib.sha256(f'{engine}\0{language or ""}\0'.encode('utf-8'))
+        key.update(content.encode('utf-8') if isinstance(content, str) else content)
+        return key.hexdigest()
+
+    @staticmethod
+    def get_file_key(path, engine, language=None):
+        """Returns the key of a file extracted by an engine, reading the file by blocks
+        :param path: path of the file
+        :param engine: name of the engine extracting the text
+        :param language: languages of the OCR
+        """
+        key = hashlib.sha256(f'{engine}\0{language or ""}\0'.encode('utf-8'))
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                key.update(block)
+        return key.hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.path, key[:2], f'{key}.txt')
+
+    def load(self):
+        """Lists the entries of the cache folder, ordered by their last use"""
+        entries = []
+        try:
+            with os.scandir(self.path) as folders:
+                for folder in folders:
+                    if not folder.is_dir():
+                        continue
+                    with os.scandir(folder.path) as files:
+                        for file in files:
+                            if file.name.endswith('.txt'):
+                                stat = file.stat()
+                                entries.append((stat.st_mtime, file.name[:-len('.txt')], stat.st_size))
+        except FileNotFoundError:
+            self.logger.debug(f"Extraction cache folder not found on path: {self.path}")
+        except OSError as exception:
+            self.logger.error(f"Error while listing the extraction cache folder {self.path}. Error: {exception}")
+
+        for _, key, size in sorted(entries):
+            self.entries[key] = size
+            self.total_bytes += size
+        self.logger.info(f"Extraction cache of {len(self.entries)} texts and {self.total_bytes} bytes loaded")
+
+    def get(self, key):
+        """Returns the cached text of a key, or None if it is not cached
+        :param key: key returned by get_key or get_file_key
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.total_misses += 1
+                return None
+
+        entry_path = self.get_entry_path(key)
+        try:
+            with open(entry_path, encoding='utf-8') as entry_file:
+                text = entry_file.read()
+            os.utime(entry_path)
+        except OSError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.total_misses += 1
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.total_hits += 1
+        return text
+
+    def put(self, key, text):
+        """Stores the text of a key, and removes the least recently used texts over the maximum size
+        :param key: key returned by get_key or get_file_key
+        :param text: extracted text
+        """
+        entry_path = self.get_entry_path(key)
+        # written to a temporary file first, so an interrupted run does not leave a truncated text
+        temporary_path = f'{entry_path}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with open(temporary_path, 'w', encoding='utf-8') as entry_file:
+                entry_file.write(text)
+            os.replace(temporary_path, entry_path)
+            size = os.path.getsize(entry_path)
+        except OSError as exception:
+            self.logger.error(f"Error while writing the extraction cache entry {entry_path}. Error: {exception}")
+            return
+
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.total_stored += 1
+            evicted_keys = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted_key, evicted_size = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.total_evicted += 1
+                evicted_keys.append(evicted_key)
+
+        for evicted_key in evicted_keys:
+            try:
+                os.remove(self.get_entry_path(evicted_key))
+            except OSError:
+                pass
+
+    def get_or_extract(self, key, extract):
+        """Returns the cached text of a key, or extracts and stores it
+        :param key: key returned by get_key or get_file_key
+        :param extract: function returning the text, or None if it could not be extracted
+        """
+        text = self.get(key)
+        if text is None:
+            text = extract()
+            if text is not None:
+                self.put(key, text)
+        return text
+
+    def get_stats(self):
+        """Returns the size and the hit metrics of the cache"""
+        with self.lock:
+            total_lookups = self.total_hits + self.total_misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'total_hits': self.total_hits,
+                'total_misses': self.total_misses,
+                'hit_ratio': round(self.total_hits / total_lookups, 3) if total_lookups else 0.0,
+                'total_stored': self.total_stored,
+                'total_evicted': self.total_evicted,
+            }
+
+
+_default_cache = None
+
+
+def set_default_cache(cache):
+    """Sets the cache used by the text extraction functions of the utils module
+    :param cache: ExtractionCache object, or None to disable the cache
+    """
+    global _default_cache
+    _default_cache = cache
+
+
+def get_default_cache():
+    """Returns the cache used by the text extraction functions of the utils module, or None"""
+    return _default_cache
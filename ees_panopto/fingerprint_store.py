@@ -0,0 +1,126 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""fingerprint_store module allows to skip the documents which did not change since they were indexed.
+
+    A fingerprint, the hash of the normalized document, is recorded for each indexed document.
+    Fetched documents having the same fingerprint as the last indexed version are not sent again.
+"""
+import hashlib
+import json
+import os
+import threading
+
+FINGERPRINTS_PATH = os.path.join(os.path.dirname(__file__), 'fingerprints.json')
+
+
+class FingerprintStore:
+    """This class keeps the fingerprints of the documents indexed in an index, by document id.
+
+    Fingerprints of the documents sent to the queue are staged, and only recorded once the
+    documents are successfully indexed, so that a failed document is sent again on the next run."""
+
+    def __init__(self, logger, index):
+        self.logger = logger
+        self.index = index
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.changed = False
+        self.total_documents_skipped = 0
+        self.fingerprints = self.load()
+
+    @staticmethod
+    def get_fingerprint(document):
+        """Returns a stable hash of the document, independent from the order of its fields
+        :param document: document to be hashed
+        """
+        normalized = json.dumps(document, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def load(self):
+        """Loads the fingerprints of the index from the fingerprints file"""
+        try:
+            with open(FINGERPRINTS_PATH, encoding='utf-8') as fingerprints_file:
+                return json.load(fingerprints_file).get(self.index, {})
+        except FileNotFoundError:
+            self.logger.debug(f"Fingerprints file not found on path: {FINGERPRINTS_PATH}")
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while parsing the fingerprints file from path: {FINGERPRINTS_PATH}. Error: {exception}")
+        return {}
+
+    def save(self):
+        """Writes the fingerprints to the fingerprints file if they changed, keeping the other indices"""
+        with self.lock:
+            if not self.changed:
+                return
+            fingerprints = dict(self.fingerprints)
+            self.changed = False
+
+        try:
+            with open(FINGERPRINTS_PATH, encoding='utf-8') as fingerprints_file:
+                all_fingerprints = json.load(fingerprints_file)
+        except (FileNotFoundError, ValueError):
+            all_fingerprints = {}
+        all_fingerprints[self.index] = fingerprints
+
+        # written to a temporary file first, so an interrupted run does not leave a truncated file
+        temporary_path = FINGERPRINTS_PATH + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as fingerprints_file:
+            json.dump(all_fingerprints, fingerprints_file)
+        os.replace(temporary_path, FINGERPRINTS_PATH)
+        self.logger.info(f"Saved the fingerprints of {len(fingerprints)} documents of the index {self.index}")
+
+    def clear(self):
+        """Forgets all the fingerprints, so that every document is sent again"""
+        with self.lock:
+            self.fingerprints = {}
+            self.pending = {}
+            self.changed = True
+
+    def filter_changed(self, documents):
+        """Returns the documents which are new or changed since they were last indexed,
+        and stages their fingerprints
+        :param documents: list of fetched documents
+        """
+        changed_documents = []
+        with self.lock:
+            for document in documents:
+                fingerprint = self.get_fingerprint(document)
+                if self.fingerprints.get(document['id']) == fingerprint:
+                    self.total_documents_skipped += 1
+                    continue
+                self.pending[document['id']] = fingerprint
+                changed_documents.append(document)
+        return changed_documents
+
+    def commit(self, ids):
+        """Records the staged fingerprints of the successfully indexed documents
+        :param ids: ids of the indexed documents
+        """
+        with self.lock:
+            for document_id in ids:
+                fingerprint = self.pending.pop(document_id, None)
+                if fingerprint:
+                    self.fingerprints[document_id] = fingerprint
+                    self.changed = True
+
+    def discard(self, ids):
+        """Drops the staged fingerprints of the documents which failed to be indexed
+        :param ids: ids of the documents
+        """
+        with self.lock:
+            for document_id in ids:
+                self.pending.pop(document_id, None)
+
+    def forget(self, ids):
+        """Forgets the fingerprints of deleted documents, so that they are indexed again if they come back
+        :param ids: ids of the documents
+        """
+        with self.lock:
+            for document_id in ids:
+                self.pending.pop(document_id, None)
+                if self.fingerprints.pop(document_id, None) is not None:
+                    self.changed = True
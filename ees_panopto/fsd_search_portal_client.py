@@ -1,30 +1,58 @@
 import json
+import logging
+import threading
 
 import pymysql
 import pymysql.cursors
 
+from .connection_pool import ConnectionPool
+from .utils import split_documents_into_equal_chunks
+
+# maximum number of urls in the IN list of a click count query
+CLICK_COUNT_BATCH_SIZE = 1000
+
 
 class FsdSearchPortalClient:
-    def __init__(self, host, database, username, password):
+    def __init__(self, host, database, username, password, min_size=1, max_size=10, idle_timeout=300,
+                 wait_timeout=None):
         self.host = host
         self.database = database
         self.username = username
         self.password = password
 
+        self.pool = ConnectionPool(
+            "FSD search portal",
+            logging.getLogger(__name__),
+            self.connect,
+            is_healthy=lambda connection: connection.ping(reconnect=False),
+            min_size=min_size,
+            max_size=max_size,
+            idle_timeout=idle_timeout,
+            wait_timeout=wait_timeout,
+        )
+
+        # click counts by url, shared by all the threads of the sync
+        self.click_counts = {}
+        self.all_click_counts_loaded = False
+        self.click_counts_lock = threading.Lock()
+
     def connect(self):
         return pymysql.connect(
             host=self.host,
             user=self.username,
             password=self.password,
             database=self.database,
-            cursorclass=pymysql.cursors.DictCursor
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=True
         )
 
+    def connection(self):
+        """Context manager returning a connection of the pool, released when the block exits"""
+        return self.pool.connection()
+
     def get_custom_ocr_configure(self, source):
         try:
-            connection = self.connect()
-
-            with connection:
+            with self.connection() as connection:
                 with connection.cursor() as cursor:
                     sql = "SELECT path, language FROM `ocr_path_setting` WHERE `source`=%s"
                     cursor.execute(sql, (source,))
@@ -37,9 +65,7 @@ class FsdSearchPortalClient:
 
     def get_categories(self):
         try:
-            connection = self.connect()
-
-            with connection:
+            with self.connection() as connection:
                 with connection.cursor() as cursor:
                     sql = "SELECT value, type FROM `extension`"
                     cursor.execute(sql)
@@ -56,16 +82,81 @@ class FsdSearchPortalClient:
         except Exception as exception:
             return {}
 
-    def get_click_count(self, url):
+    def load_click_counts(self):
+        """Load the click counts of all the urls with a single query, so that the following
+        lookups are answered from memory"""
         try:
-            connection = self.connect()
-
-            with connection:
+            with self.connection() as connection:
                 with connection.cursor() as cursor:
-                    sql = "SELECT COUNT(*) AS click_count FROM click_log WHERE url = %s"
-                    cursor.execute(sql, (url,))
-                    result = cursor.fetchone()['click_count']
+                    sql = "SELECT url, COUNT(*) AS click_count FROM click_log GROUP BY url"
+                    cursor.execute(sql)
+                    results = cursor.fetchall()
 
-            return result
+            with self.click_counts_lock:
+                self.click_counts = {result['url']: result['click_count'] for result in results}
+                self.all_click_counts_loaded = True
         except Exception as exception:
-            return 0
+            pass
+
+    def get_click_counts(self, urls):
+        """Return the click counts of the urls. Urls which are not cached yet are counted
+        together with one query per batch of urls
+        :param urls: list of urls
+        Returns:
+            click_counts: dictionary of url and click count
+        """
+        with self.click_counts_lock:
+            if self.all_click_counts_loaded:
+                missing_urls = []
+            else:
+                missing_urls = [url for url in dict.fromkeys(urls) if url not in self.click_counts]
+
+        if missing_urls:
+            try:
+                counts = self.count_clicks(missing_urls)
+
+                with self.click_counts_lock:
+                    self.click_counts.update(counts)
+            except Exception as exception:
+                pass
+
+        return {url: self.click_counts.get(url, 0) for url in urls}
+
+    def count_clicks(self, urls):
+        """Count the clicks of the urls with one query per batch of urls
+        :param urls: list of urls
+        Returns:
+            click_counts: dictionary of url and click count
+        """
+        counts = dict.fromkeys(urls, 0)
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                for url_batch in split_documents_into_equal_chunks(list(counts), CLICK_COUNT_BATCH_SIZE):
+                    placeholders = ', '.join(['%s'] * len(url_batch))
+                    sql = (f"SELECT url, COUNT(*) AS click_count FROM click_log "
+                           f"WHERE url IN ({placeholders}) GROUP BY url")
+                    cursor.execute(sql, url_batch)
+                    for result in cursor.fetchall():
+                        counts[result['url']] = result['click_count']
+
+        return counts
+
+    def get_click_log_changes(self, watermark):
+        """Return the urls clicked since the watermark and the new watermark
+        :param watermark: id of the last click_log row already processed
+        Returns:
+            urls: list of urls having new click_log rows
+            last_id: id of the last click_log row, or the given watermark if there is no new row
+        """
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                sql = "SELECT url, MAX(id) AS last_id FROM click_log WHERE id > %s GROUP BY url"
+                cursor.execute(sql, (watermark,))
+                results = cursor.fetchall()
+
+        urls = [result['url'] for result in results]
+        last_id = max([result['last_id'] for result in results], default=watermark)
+        return urls, last_id
+
+    def get_click_count(self, url):
+        return self.get_click_counts([url])[url]
@@ -8,16 +8,17 @@
     It will attempt to sync absolutely all documents that are available in the
     third-party system and ingest them into Enterprise Search instance.
 """
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from .base_command import BaseCommand
-from .checkpointing import Checkpoint
+from .checkpointing import Checkpoint, PartitionCheckpoint
 from .connector_queue import ConnectorQueue
 from .local_storage import LocalStorage
 from .sync_elastic_search import SyncElasticSearch
 from .sync_enterprise_search import SyncEnterpriseSearch
 from .sync_panopto import SyncPanopto
-from .utils import get_current_time, split_date_range_into_chunks
+from .utils import get_current_time
 
 INDEXING_TYPE = "full"
 
@@ -25,10 +26,11 @@ INDEXING_TYPE = "full"
 class FullSyncCommand(BaseCommand):
     """This class start executions of fullsync feature."""
 
-    def start_producer(self, queue):
+    def start_producer(self, queue, partition_checkpoint):
         """This method starts async calls for the producer which is responsible
         for fetching documents from the Network Drive and pushing them in the shared queue
         :param queue: Shared queue to store the fetched documents
+        :param partition_checkpoint: PartitionCheckpoint object recording the progress of the partitions
         :param time_range: Time range dictionary storing start time and end time
         """
         self.logger.debug("Starting the full indexing..")
@@ -40,6 +42,7 @@ class FullSyncCommand(BaseCommand):
         start_time, end_time = self.config.get_value(
             "start_time"), current_time
 
+        sync_panopto = None
         try:
             sync_panopto = SyncPanopto(
                 self.config,
@@ -49,37 +52,38 @@ class FullSyncCommand(BaseCommand):
                 queue,
                 self.leadtools_engine,
                 self.panopto_client,
-                start_time,
-                end_time
-            )
-            datelist = split_date_range_into_chunks(
                 start_time,
                 end_time,
-                thread_count,
+                self.fingerprint_store,
+                self.local_storage,
+                partition_checkpoint,
             )
-            time_range_list = [(datelist[num], datelist[num + 1])
-                               for num in range(0, thread_count)]
-            storage_with_collection = self.local_storage.get_storage_with_collection()
-            global_keys = self.create_jobs(
-                thread_count, sync_panopto.perform_sync, (), time_range_list)
-
-            try:
-                storage_with_collection["global_keys"]["videos"].update(
-                    global_keys)
-            except ValueError as value_error:
-                self.logger.error(
-                    f"Exception while updating storage: {value_error}")
-
-            # Send end signals for each live threads to notify them to close watching the queue
-            # for any incoming documents
-            for _ in range(self.config.get_value("enterprise_search_sync_thread_count")):
-                queue.end_signal()
+            # The unfinished partitions of an interrupted run are resumed before starting a new run
+            time_range_list = partition_checkpoint.resume()
+            if time_range_list is None:
+                # Many small partitions with similar numbers of sessions are queued, so that a
+                # thread finishing early picks up the next one instead of waiting for the others
+                time_range_list = sync_panopto.get_date_partitions(
+                    start_time,
+                    end_time,
+                    thread_count * self.config.get_value("panopto_partitions_per_thread"),
+                )
+                partition_checkpoint.start(time_range_list)
+            if time_range_list:
+                self.create_jobs(
+                    thread_count, sync_panopto.perform_sync, (), time_range_list)
         except Exception as exception:
             self.logger.error(
                 "Error while Fetching from Panopto. Checkpoint not saved")
             raise exception
-
-        self.local_storage.update_storage(storage_with_collection)
+        finally:
+            if sync_panopto:
+                # keeps the thumbnails of the sessions found after the index was refreshed, even when the sync failed
+                sync_panopto.close()
+            # Send end signals for each live threads to notify them to close watching the queue
+            # for any incoming documents
+            for _ in range(self.config.get_value("enterprise_search_sync_thread_count")):
+                queue.end_signal()
 
     def start_consumer(self, queue):
         """This method starts async calls for the consumer which is responsible for indexing documents to the Enterprise Search
@@ -89,7 +93,7 @@ class FullSyncCommand(BaseCommand):
         thread_count = self.config.get_value(
             "enterprise_search_sync_thread_count")
         sync_es = SyncElasticSearch(
-            self.config, logger, self.elastic_search_custom_client, queue)
+            self.config, logger, self.elastic_search_custom_client, queue, self.fingerprint_store)
 
         self.create_jobs(
             thread_count, sync_es.perform_sync, (), None)
@@ -107,22 +111,62 @@ class FullSyncCommand(BaseCommand):
 
         logger.info(f"Indexing started at: {current_time}")
 
-        queue = ConnectorQueue(logger)
-
-        self.start_producer(queue)
-
-        total_documents_found, total_documents_indexed, total_documents_appended, total_documents_updated, total_documents_failed = self.start_consumer(
-            queue)
-
-        checkpoint.set_checkpoint(current_time, INDEXING_TYPE, 'panopto')
+        queue = ConnectorQueue(
+            logger,
+            config.get_value("connector_queue.max_size"),
+            config.get_value("connector_queue.max_bytes"),
+        )
+
+        # All the click counts are loaded at once, instead of a lookup for each block of videos
+        self.fsd_search_portal_client.load_click_counts()
+
+        partition_checkpoint = PartitionCheckpoint(logger, 'panopto', INDEXING_TYPE, current_time)
+
+        # Created before the producer threads share them
+        fingerprint_store = self.fingerprint_store
+        local_storage = self.local_storage
+
+        # The producer runs alongside the consumers, so documents are indexed while they are fetched
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            producer = executor.submit(self.start_producer, queue, partition_checkpoint)
+
+            (
+                total_documents_found,
+                total_documents_indexed,
+                total_documents_appended,
+                total_documents_updated,
+                total_documents_failed,
+                _,
+            ) = self.start_consumer(queue)
+
+            producer.result()
+
+        if fingerprint_store:
+            fingerprint_store.save()
+        local_storage.close()
+
+        # The checkpoint only moves once every partition is indexed, otherwise the next run
+        # resumes the unfinished partitions
+        partition_checkpoint.flush()
+        unfinished_partitions = partition_checkpoint.get_unfinished_partitions()
+        if unfinished_partitions:
+            logger.warning(
+                f"{len(unfinished_partitions)} partitions were not completely indexed. Checkpoint not saved, "
+                "the next run resumes them")
+        else:
+            checkpoint.set_checkpoint(partition_checkpoint.checkpoint_time, INDEXING_TYPE, 'panopto')
+            partition_checkpoint.clear()
         logger.info(f"Indexing ended at: {get_current_time()}")
+        logger.info(f"Queue statistics: {queue.get_stats()}")
+        self.close_connection_pools()
 
         output = {
             'total_documents_found': total_documents_found,
             'total_documents_indexed': total_documents_indexed,
             'total_documents_appended': total_documents_appended,
             'total_documents_updated': total_documents_updated,
-            'total_documents_failed': total_documents_failed
+            'total_documents_failed': total_documents_failed,
+            'total_documents_skipped': fingerprint_store.total_documents_skipped if fingerprint_store else 0
         }
 
         return output
@@ -10,26 +10,30 @@ third-party system recently and ingest them into Enterprise Search instance.
 
 Recency is determined by the time when the last successful incremental or full job
 was ran."""
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from .base_command import BaseCommand
-from .checkpointing import Checkpoint
+from .checkpointing import Checkpoint, PartitionCheckpoint
 from .connector_queue import ConnectorQueue
 from .sync_elastic_search import SyncElasticSearch
 from .sync_enterprise_search import SyncEnterpriseSearch
-from .sync_panopto import SyncPanopto
-from .utils import get_current_time, split_date_range_into_chunks
+from .sync_panopto import MAX_SESSIONS_PER_QUERY, SyncPanopto
+from .utils import get_current_time, split_documents_into_equal_chunks
 
 INDEXING_TYPE = "incremental"
+CHANGE_TRACKING_WATERMARK = "panopto_change_tracking"
 
 
 class IncrementalSyncCommand(BaseCommand):
     """This class start execution of incremental sync feature."""
 
-    def start_producer(self, queue, time_range):
+    def start_producer(self, queue, time_range, partition_checkpoint):
         """This method starts async calls for the producer which is responsible for fetching documents from the
         SharePoint and pushing them in the shared queue
         :param queue: Shared queue to fetch the stored documents
+        :param time_range: Time range dictionary storing start time and end time
+        :param partition_checkpoint: PartitionCheckpoint object recording the progress of the partitions
         """
         self.logger.debug("Starting the incremental indexing..")
 
@@ -37,6 +41,7 @@ class IncrementalSyncCommand(BaseCommand):
 
         start_time, end_time = time_range["start_time"], time_range["end_time"]
 
+        sync_panopto = None
         try:
             sync_panopto = SyncPanopto(
                 self.config,
@@ -48,33 +53,92 @@ class IncrementalSyncCommand(BaseCommand):
                 self.panopto_client,
                 start_time,
                 end_time,
+                self.fingerprint_store,
+                self.local_storage,
+                partition_checkpoint,
             )
-            datelist = split_date_range_into_chunks(
-                start_time,
-                end_time,
-                thread_count,
-            )
-            time_range_list = [(datelist[num], datelist[num + 1])
-                               for num in range(0, thread_count)]
-            storage_with_collection = self.local_storage.get_storage_with_collection()
-            global_keys = self.create_jobs(
-                thread_count, sync_panopto.perform_sync, (), time_range_list)
-
+            if self.config.get_value("incremental_sync_mode") == "change_tracking" and \
+                    self.sync_changed_sessions(sync_panopto, thread_count):
+                time_range_list = []
+            else:
+                # The unfinished partitions of an interrupted run are resumed before starting a new run
+                time_range_list = partition_checkpoint.resume()
+            if time_range_list is None:
+                # Many small partitions with similar numbers of sessions are queued, so that a
+                # thread finishing early picks up the next one instead of waiting for the others
+                time_range_list = sync_panopto.get_date_partitions(
+                    start_time,
+                    end_time,
+                    thread_count * self.config.get_value("panopto_partitions_per_thread"),
+                )
+                partition_checkpoint.start(time_range_list)
+            if time_range_list:
+                self.create_jobs(
+                    thread_count, sync_panopto.perform_sync, (), time_range_list)
+
+            # The videos deleted or hidden since they were indexed are removed by the same consumers.
+            # With change tracking, only the sessions changed since the last version are checked
             try:
-                storage_with_collection["global_keys"]["videos"].update(
-                    global_keys)
-            except ValueError as value_error:
-                self.logger.error(
-                    f"Exception while updating storage: {value_error}")
+                sync_panopto.sync_deleted_videos(self.changed_session_ids)
+            except Exception as exception:
+                self.logger.exception(
+                    f"Error while fetching the deleted videos. Error {exception}")
 
+        except Exception as exception:
+            self.logger.exception(
+                f"Error while fetching the objects . Error {exception}")
+            raise exception
+        finally:
+            if sync_panopto:
+                # keeps the thumbnails of the sessions found after the index was refreshed, even when the sync failed
+                sync_panopto.close()
             for _ in range(self.config.get_value("enterprise_search_sync_thread_count")):
                 queue.end_signal()
 
+    def sync_changed_sessions(self, sync_panopto, thread_count):
+        """Fetches the videos of the sessions changed since the change tracking version of the last run.
+        Returns False when the start time windows have to be synced instead, because change tracking is
+        not enabled, or there is no version yet, or the changes since the version were cleaned up
+        :param sync_panopto: SyncPanopto object
+        :param thread_count: number of threads fetching the videos
+        """
+        try:
+            current_version, min_valid_version = sync_panopto.get_change_tracking_versions()
         except Exception as exception:
             self.logger.exception(
-                f"Error while fetching the objects . Error {exception}")
-            raise exception
-        self.local_storage.update_storage(storage_with_collection)
+                f"Error while reading the change tracking versions, syncing the start time window instead. "
+                f"Error {exception}")
+            return False
+
+        # Read before the changes, so that the changes made during the run are fetched again next time
+        self.change_tracking_version = current_version
+        last_version = Checkpoint(self.config, self.logger).get_watermark(CHANGE_TRACKING_WATERMARK)
+        if last_version is None or last_version < min_valid_version:
+            self.logger.warning(
+                f"The change tracking version {last_version} is missing or older than the retention period of "
+                f"the changes, syncing the start time window instead")
+            return False
+
+        try:
+            session_ids = sync_panopto.get_changed_session_ids(last_version)
+        except Exception as exception:
+            self.logger.exception(
+                f"Error while reading the sessions changed since the change tracking version {last_version}, "
+                f"syncing the start time window instead. Error {exception}")
+            return False
+        self.changed_session_ids = session_ids
+        session_batches = split_documents_into_equal_chunks(
+            session_ids, min(self.config.get_value("panopto_db.fetch_batch_size"), MAX_SESSIONS_PER_QUERY))
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            futures = [executor.submit(sync_panopto.perform_sync_sessions, session_batch)
+                       for session_batch in session_batches]
+
+        for future in futures:
+            if future.exception():
+                self.change_tracking_failed = True
+                self.logger.error(
+                    f"Error while fetching the videos of the changed sessions. Error {future.exception()}")
+        return True
 
     def start_consumer(self, queue):
         """This method starts async calls for the consumer which is responsible for indexing documents to the
@@ -85,7 +149,8 @@ class IncrementalSyncCommand(BaseCommand):
         thread_count = self.config.get_value(
             "enterprise_search_sync_thread_count")
         sync_es = SyncElasticSearch(
-            self.config, logger, self.elastic_search_custom_client, queue)
+            self.config, logger, self.elastic_search_custom_client, queue, self.fingerprint_store,
+            self.local_storage)
 
         self.create_jobs(
             thread_count, sync_es.perform_sync, (True,), None)
@@ -110,22 +175,71 @@ class IncrementalSyncCommand(BaseCommand):
         }
         logger.info(f"Indexing started at: {current_time}")
 
-        queue = ConnectorQueue(logger)
-
-        self.start_producer(queue, time_range)
-
-        total_documents_found, total_documents_indexed, total_documents_appended, total_documents_updated, total_documents_failed = self.start_consumer(
-            queue)
-
-        checkpoint.set_checkpoint(current_time, INDEXING_TYPE, 'panopto')
+        queue = ConnectorQueue(
+            logger,
+            config.get_value("connector_queue.max_size"),
+            config.get_value("connector_queue.max_bytes"),
+        )
+
+        partition_checkpoint = PartitionCheckpoint(logger, 'panopto', INDEXING_TYPE, current_time)
+        self.change_tracking_version = None
+        self.change_tracking_failed = False
+        self.changed_session_ids = None
+
+        # Created before the producer threads share them
+        fingerprint_store = self.fingerprint_store
+        local_storage = self.local_storage
+
+        # The producer runs alongside the consumers, so documents are indexed while they are fetched
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            producer = executor.submit(self.start_producer, queue, time_range, partition_checkpoint)
+
+            (
+                total_documents_found,
+                total_documents_indexed,
+                total_documents_appended,
+                total_documents_updated,
+                total_documents_failed,
+                total_documents_deleted,
+            ) = self.start_consumer(queue)
+
+            producer.result()
+
+        if fingerprint_store:
+            fingerprint_store.save()
+        local_storage.close()
+
+        self.elastic_search_custom_client.save_id_map()
+        # The checkpoint only moves once every partition is indexed, otherwise the next run
+        # resumes the unfinished partitions
+        partition_checkpoint.flush()
+        unfinished_partitions = partition_checkpoint.get_unfinished_partitions()
+        if unfinished_partitions:
+            logger.warning(
+                f"{len(unfinished_partitions)} partitions were not completely indexed. Checkpoint not saved, "
+                "the next run resumes them")
+        else:
+            checkpoint.set_checkpoint(partition_checkpoint.checkpoint_time, INDEXING_TYPE, 'panopto')
+            partition_checkpoint.clear()
+
+        # The version only moves once all the changes are indexed, otherwise they are fetched again next time
+        if self.change_tracking_version is not None:
+            if unfinished_partitions or self.change_tracking_failed or total_documents_failed:
+                logger.warning("Some changes were not indexed. Change tracking version not saved")
+            else:
+                checkpoint.set_watermark(self.change_tracking_version, CHANGE_TRACKING_WATERMARK)
         logger.info(f"Indexing ended at: {get_current_time()}")
+        logger.info(f"Queue statistics: {queue.get_stats()}")
+        self.close_connection_pools()
 
         output = {
             'total_documents_found': total_documents_found,
             'total_documents_indexed': total_documents_indexed,
             'total_documents_appended': total_documents_appended,
             'total_documents_updated': total_documents_updated,
-            'total_documents_failed': total_documents_failed
+            'total_documents_failed': total_documents_failed,
+            'total_documents_deleted': total_documents_deleted,
+            'total_documents_skipped': fingerprint_store.total_documents_skipped if fingerprint_store else 0
         }
 
         return output
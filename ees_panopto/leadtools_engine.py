@@ -1,6 +1,8 @@
 import os
 import sys
 import tempfile
+import threading
+from contextlib import contextmanager
 
 # sys.path.append("C:/LEADTOOLS22/Examples/Common/Python") 
 from DemosTools import *
@@ -23,6 +25,11 @@ from System.Collections.Generic import *
 from System.IO import *
 from System.Net import *
 
+from .connection_pool import ConnectionPool
+
+# languages of the OCR when none is given
+DEFAULT_LANGUAGES = "en,zh-Hant"
+
 
 class LeadTools:
     def __init__(self, config, logger):
@@ -32,6 +39,24 @@ class LeadTools:
         self.startup_parameters = config.get_value('leadtoools.startup_parameters')
 
         self.enable_leadtools_ocr = config.get_value("enable_leadtools_ocr")
+        self.extraction_cache = config.extraction_cache
+
+        # started engines shared by the threads, each one recycled after max_documents_per_engine documents
+        self.max_documents_per_engine = config.get_value('leadtools.max_documents_per_engine')
+        pool_size = config.get_value('leadtools.engine_pool_size') or \
+            config.get_value('panopto_sync_thread_count')
+        self.pool = ConnectionPool(
+            "LeadTools engines",
+            logger,
+            self.start_engine,
+            close_connection=self.shutdown_engine,
+            min_size=pool_size,
+            max_size=pool_size,
+            idle_timeout=None,
+        )
+        # enabled languages and number of recognized documents of the pooled engines, by engine id
+        self.engine_states = {}
+        self.engine_states_lock = threading.Lock()
 
         if self.enable_leadtools_ocr:
             try:
@@ -57,7 +82,59 @@ class LeadTools:
             self.logger.exception(f"Unknown error while connecting to Leadtools. Error: {exception}")
             raise exception   
           
-    def run_leadtools_ocr_on_temp_file(self, ocr_engine, path, file_content, lang=None):
+    def start_engine(self):
+        """Starts an engine for the pool"""
+        ocr_engine = self.connect()
+        with self.engine_states_lock:
+            self.engine_states[id(ocr_engine)] = {'languages': None, 'documents': 0}
+        return ocr_engine
+
+    def shutdown_engine(self, ocr_engine):
+        """Shuts down an engine of the pool and releases its native memory"""
+        with self.engine_states_lock:
+            self.engine_states.pop(id(ocr_engine), None)
+        ocr_engine.Shutdown()
+        ocr_engine.Dispose()
+
+    @contextmanager
+    def engine(self):
+        """Context manager lending a started engine of the pool to the calling thread. The engine
+        is shut down instead of being given back once it recognized max_documents_per_engine documents,
+        or if the recognition failed"""
+        ocr_engine = self.pool.acquire()
+        discard = True
+        try:
+            yield ocr_engine
+            with self.engine_states_lock:
+                documents = self.engine_states[id(ocr_engine)]['documents']
+            discard = documents >= self.max_documents_per_engine
+        finally:
+            self.pool.release(ocr_engine, discard=discard)
+
+    def enable_languages(self, ocr_engine, lang=None):
+        """Enables the languages of a recognition, unless they are already enabled on the pooled engine
+        :param ocr_engine: started engine
+        :param lang: languages separated by commas
+        """
+        languages = (lang or DEFAULT_LANGUAGES).split(',')
+        with self.engine_states_lock:
+            state = self.engine_states.get(id(ocr_engine))
+        if state and state['languages'] == languages:
+            return
+
+        ocr_engine.LanguageManager.EnableLanguages(languages)
+        if state:
+            state['languages'] = languages
+        self.logger.info(f"Enabled the OCR languages {', '.join(ocr_engine.LanguageManager.GetEnabledLanguages())}")
+
+    def count_document(self, ocr_engine):
+        """Counts a document recognized by a pooled engine"""
+        with self.engine_states_lock:
+            state = self.engine_states.get(id(ocr_engine))
+            if state:
+                state['documents'] += 1
+
+    def run_leadtools_ocr_on_temp_file(self, path, file_content, lang=None):
         text = ''
         file_extension = os.path.splitext(path)[1].lower()
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as file_obj:
@@ -65,11 +142,11 @@ class LeadTools:
             file_obj.write(file_content)
 
         self.logger.info('run_leadtools_ocr_on_temp_file %s %s' % (file_name, file_extension))
-        text = self.run_leadtools_ocr(ocr_engine, file_name, lang)
+        text = self.run_leadtools_ocr(file_name, lang)
         os.remove(file_name)
         return text
     
-    def run_leadtools_icr_on_temp_file(self, ocr_engine, path, file_content, lang=None):
+    def run_leadtools_icr_on_temp_file(self, path, file_content, lang=None):
         text = ''
         file_extension = os.path.splitext(path)[1].lower()
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as file_obj:
@@ -77,30 +154,55 @@ class LeadTools:
             file_obj.write(file_content)
 
         self.logger.info('run_leadtools_icr_on_temp_file %s %s' % (file_name, file_extension))
-        text = self.run_leadtools_icr(ocr_engine, file_name, lang)
+        text = self.run_leadtools_icr(file_name, lang)
         os.remove(file_name)
         return text
     
 
-    def run_leadtools_ocr(self, ocr_engine, file, lang=None):
+    def get_cached_text(self, file, engine, lang, recognize):
+        """Returns the text of a file from the extraction cache, or recognizes and stores it
+        :param file: path of the file
+        :param engine: name of the recognition
+        :param lang: languages of the recognition, separated by commas
+        :param recognize: function returning the text of the file
+        """
+        if not self.extraction_cache:
+            return recognize()
+        key = self.extraction_cache.get_file_key(file, engine, lang or DEFAULT_LANGUAGES)
+        return self.extraction_cache.get_or_extract(key, recognize)
+
+    def run_leadtools_ocr(self, file, lang=None):
+        """Returns the text recognized in a file by an engine of the pool, which is only borrowed
+        when the text is not in the extraction cache"""
+        return self.get_cached_text(file, 'leadtools_ocr', lang, lambda: self.recognize_with_engine(
+            self.recognize_ocr, file, lang))
+
+    def run_leadtools_icr(self, file, lang=None):
+        """Returns the handwritten text recognized in a file by an engine of the pool, which is only
+        borrowed when the text is not in the extraction cache"""
+        return self.get_cached_text(file, 'leadtools_icr', lang, lambda: self.recognize_with_engine(
+            self.recognize_icr, file, lang))
+
+    def recognize_with_engine(self, recognize, file, lang=None):
+        """Runs a recognition on an engine borrowed from the pool
+        :param recognize: recognize_ocr or recognize_icr
+        :param file: path of the file
+        :param lang: languages of the recognition, separated by commas
+        """
+        with self.engine() as ocr_engine:
+            return recognize(ocr_engine, file, lang)
+
+    def recognize_ocr(self, ocr_engine, file, lang=None):
         ocr_document = ocr_engine.DocumentManager.CreateDocument() 
 
         ocr_document.Pages.AddPages(file, 1, -1, None) 
         ocr_document.Pages.AutoZone(None) 
 
-        if lang:
-            ocr_engine.LanguageManager.EnableLanguages(lang.split(','))
-        else:
-            ocr_engine.LanguageManager.EnableLanguages(["en", "zh-Hant"])
+        self.enable_languages(ocr_engine, lang)
         # supportedLanguages = ocr_engine.LanguageManager.GetSupportedLanguages()
         # for lang in supportedLanguages:
         #     print(lang)
 
-        enabledLanguages = ocr_engine.LanguageManager.GetEnabledLanguages()
-        for lang in enabledLanguages:
-            # print(lang)
-            self.logger.info(lang)
-
         ocr_document.Pages.Recognize(None)
 
         all_pages_text = ""
@@ -110,19 +212,17 @@ class LeadTools:
             all_pages_text += page_text
 
         ocr_document.Dispose()
+        self.count_document(ocr_engine)
 
         return all_pages_text
 
-    def run_leadtools_icr(self, ocr_engine, file, lang=None):
+    def recognize_icr(self, ocr_engine, file, lang=None):
         ocr_document = ocr_engine.DocumentManager.CreateDocument() 
 
         ocr_document.Pages.AddPages(file, 1, -1, None) 
         ocr_document.Pages.AutoZone(None) 
 
-        if lang:
-            ocr_engine.LanguageManager.EnableLanguages(lang.split(','))
-        else:
-            ocr_engine.LanguageManager.EnableLanguages(["en", "zh-Hant"])
+        self.enable_languages(ocr_engine, lang)
         # supportedLanguages = ocr_engine.LanguageManager.GetSupportedLanguages()
         # for lang in supportedLanguages:
         #     print(lang)
@@ -147,5 +247,6 @@ class LeadTools:
             all_pages_text += page_text
 
         ocr_document.Dispose()
+        self.count_document(ocr_engine)
 
         return all_pages_text
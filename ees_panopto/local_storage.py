@@ -1,56 +1,177 @@
-import copy
 import json
 import os
+import sqlite3
+import threading
 
 IDS_PATH = os.path.join(os.path.dirname(__file__), 'doc_id.json')
+IDS_DB_PATH = os.path.join(os.path.dirname(__file__), 'doc_id.db')
 
 
 class LocalStorage:
-    """This class contains all the methods to do operations on doc_id json file
+    """This class contains all the methods to do operations on the local ids storage.
+
+    The ids are stored in an embedded SQLite database in WAL mode, so that they can be
+    upserted and compared incrementally instead of rewriting the whole doc_id.json file.
+    An existing doc_id.json file is imported when the database is created.
     """
 
-    def __init__(self, logger):
+    def __init__(self, logger, path=IDS_DB_PATH):
         self.logger = logger
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ids ("
+            "collection TEXT NOT NULL, id TEXT NOT NULL, url TEXT, PRIMARY KEY (collection, id)"
+            ") WITHOUT ROWID"
+        )
+        self.import_json_storage()
+
+    def import_json_storage(self):
+        """Imports the ids of the former doc_id.json file into an empty database"""
+        if not os.path.exists(IDS_PATH):
+            return
+        with self.lock:
+            if self.connection.execute("SELECT 1 FROM ids LIMIT 1").fetchone():
+                return
 
-    def load_storage(self):
-        """This method fetches the contents of doc_id.json(local ids storage)
-        """
         try:
             with open(IDS_PATH, encoding='utf-8') as ids_file:
-                try:
-                    return json.load(ids_file)
-                except ValueError as exception:
-                    self.logger.exception(
-                        f"Error while parsing the json file of the ids store from path: {IDS_PATH}. Error: {exception}"
-                    )
-                    return {"global_keys": {}}
-        except FileNotFoundError:
-            self.logger.debug("Local storage for ids was not found.")
-            return {"global_keys": {}}
+                global_keys = json.load(ids_file).get("global_keys") or {}
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while parsing the json file of the ids store from path: {IDS_PATH}. Error: {exception}"
+            )
+            return
+
+        for collection, ids in global_keys.items():
+            self.upsert_ids(collection, ids)
+        self.logger.info(f"Imported the ids of {IDS_PATH} into {self.path}")
+
+    def load_storage(self):
+        """This method fetches the contents of the local ids storage
+        """
+        global_keys = {}
+        with self.lock:
+            for collection, document_id, url in self.connection.execute("SELECT collection, id, url FROM ids"):
+                global_keys.setdefault(collection, {})[document_id] = url
+        return {"global_keys": global_keys}
 
     def update_storage(self, ids):
-        """This method is used to update the ids stored in doc_id.json file
-            :param ids: updated ids to be stored in the doc_id.json file
+        """This method is used to replace the ids stored in the local ids storage
+            :param ids: updated ids to be stored, in the format returned by load_storage
         """
-        with open(IDS_PATH, "w", encoding='utf-8') as ids_file:
+        with self.lock:
             try:
-                json.dump(ids, ids_file, indent=4)
-            except ValueError as exception:
+                self.connection.execute("BEGIN")
+                self.connection.execute("DELETE FROM ids")
+                for collection, collection_ids in (ids.get("global_keys") or {}).items():
+                    self.connection.executemany(
+                        "INSERT INTO ids (collection, id, url) VALUES (?, ?, ?)",
+                        ((collection, document_id, url) for document_id, url in collection_ids.items()))
+                self.connection.execute("COMMIT")
+            except sqlite3.Error as exception:
+                self.connection.execute("ROLLBACK")
                 self.logger.exception(
-                    f"Error while updating the doc_id json file. Error: {exception}"
+                    f"Error while updating the ids storage. Error: {exception}"
                 )
 
-    def get_storage_with_collection(self):
-        """Returns a dictionary containing the locally stored IDs of files fetched from SharePoint
-            :param collection: The SharePoint server collection which is currently being fetched
+    def upsert_ids(self, collection, ids):
+        """Adds or updates ids of a collection in a single transaction
+            :param collection: collection of the ids, like videos
+            :param ids: dictionary of id and url
         """
-        storage_with_collection = {"global_keys": {}, "delete_keys": {}}
-        ids_collection = self.load_storage()
-        storage_with_collection["delete_keys"] = copy.deepcopy(ids_collection.get("global_keys"))
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(
+                    "INSERT INTO ids (collection, id, url) VALUES (?, ?, ?) "
+                    "ON CONFLICT (collection, id) DO UPDATE SET url = excluded.url",
+                    ((collection, document_id, url) for document_id, url in ids.items()))
+                self.connection.execute("COMMIT")
+            except sqlite3.Error as exception:
+                self.connection.execute("ROLLBACK")
+                self.logger.exception(
+                    f"Error while updating the ids storage. Error: {exception}"
+                )
+
+    def delete_ids(self, collection, ids):
+        """Removes ids of a collection in a single transaction
+            :param collection: collection of the ids, like videos
+            :param ids: list of ids
+        """
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(
+                    "DELETE FROM ids WHERE collection = ? AND id = ?",
+                    ((collection, document_id) for document_id in ids))
+                self.connection.execute("COMMIT")
+            except sqlite3.Error as exception:
+                self.connection.execute("ROLLBACK")
+                self.logger.exception(
+                    f"Error while deleting from the ids storage. Error: {exception}"
+                )
 
-        if not ids_collection["global_keys"]:
-            ids_collection["global_keys"] = {"videos": {}}
+    def get_existing_ids(self, collection, ids):
+        """Returns the ids of a collection which are stored
+            :param collection: collection of the ids, like videos
+            :param ids: list of ids
+        """
+        existing_ids = []
+        with self.lock:
+            # SQLite limits the number of parameters of a query
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT id FROM ids WHERE collection = ? AND id IN ({', '.join('?' * len(chunk))})",
+                    (collection, *chunk),
+                ).fetchall()
+                existing_ids.extend(row[0] for row in rows)
+        return existing_ids
+
+    def get_missing_ids(self, collection, live_ids):
+        """Returns the stored ids of a collection which are not in live_ids, ignoring their case. The live ids
+        are streamed into a temporary table, so the difference is computed by SQLite and not held in memory
+            :param collection: collection of the ids, like videos
+            :param live_ids: iterable of the ids which still exist
+        """
+        with self.lock:
+            try:
+                self.connection.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS live_ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+                self.connection.execute("BEGIN")
+                self.connection.execute("DELETE FROM live_ids")
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO live_ids (id) VALUES (lower(?))",
+                    ((str(document_id),) for document_id in live_ids))
+                rows = self.connection.execute(
+                    "SELECT id FROM ids WHERE collection = ? AND lower(id) NOT IN (SELECT id FROM live_ids)",
+                    (collection,)
+                ).fetchall()
+                self.connection.execute("DELETE FROM live_ids")
+                self.connection.execute("COMMIT")
+            except sqlite3.Error as exception:
+                self.connection.execute("ROLLBACK")
+                self.logger.exception(
+                    f"Error while comparing the ids storage with the live ids. Error: {exception}"
+                )
+                return []
+        return [row[0] for row in rows]
 
-        storage_with_collection["global_keys"] = copy.deepcopy(ids_collection["global_keys"])
+    def get_storage_with_collection(self):
+        """Returns a dictionary containing the locally stored IDs of the videos fetched from Panopto
+        """
+        storage_with_collection = {"global_keys": {}, "delete_keys": {}}
+        # each load builds new dictionaries, so the two collections do not share their contents
+        storage_with_collection["delete_keys"] = self.load_storage()["global_keys"]
+        storage_with_collection["global_keys"] = self.load_storage()["global_keys"] or {"videos": {}}
 
         return storage_with_collection
+
+    def close(self):
+        """Closes the database, which moves the content of the write ahead log into the database file"""
+        with self.lock:
+            self.connection.close()
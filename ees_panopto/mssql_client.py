@@ -8,6 +8,7 @@
 """
 import pyodbc
 
+from .connection_pool import ConnectionPool
 from .utils import retry
 
 
@@ -30,6 +31,21 @@ class MSSQL:
         # self.password = config.get_value("network_drive.password")
         self.retry_count = int(config.get_value("retry_count"))
 
+        # Each producer thread streams the videos on one connection while it queries their
+        # contents on another one, so a smaller pool could leave every thread waiting for its second one
+        max_size = max(config.get_value("connection_pool.max_size") or 0,
+                       2 * config.get_value("panopto_sync_thread_count"))
+        self.pool = ConnectionPool(
+            "MSSQL",
+            logger,
+            self.connect,
+            is_healthy=self.is_healthy,
+            min_size=config.get_value("connection_pool.min_size"),
+            max_size=max_size,
+            idle_timeout=config.get_value("connection_pool.idle_timeout"),
+            wait_timeout=config.get_value("connection_pool.wait_timeout"),
+        )
+
     @retry(exception_list=(pyodbc.Error))
     def connect(self):
         try:
@@ -38,7 +54,8 @@ class MSSQL:
                 'SERVER=' + self.host + ';'
                 'DATABASE=' + self.database + ';'
                 'UID=' + self.user + ';'
-                'PWD=' + self.password
+                'PWD=' + self.password,
+                autocommit=True
             )
             return conn
         except pyodbc.Error as exception:
@@ -47,7 +64,28 @@ class MSSQL:
             self.logger.exception(f"Unknown error while connecting to MSSQL. Error: {exception}")
             raise exception
 
-    def execute_query(self, conn, query, params=None, fetch_method='fetchall'):
+    def connection(self):
+        """Context manager returning a connection of the pool, released when the block exits"""
+        return self.pool.connection()
+
+    @staticmethod
+    def is_healthy(conn):
+        """Checks that a pooled connection can still run a query"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        cursor.close()
+        return True
+
+    def execute_query(self, conn, query, params=None, fetch_method='fetchall', size=None):
+        """Execute the query and fetch its result
+        :param conn: connection returned by connect
+        :param query: query to be executed
+        :param params: parameters of the query
+        :param fetch_method: 'fetchall', 'fetchone' or 'fetchmany'. With 'fetchmany' a generator
+            yielding lists of at most size rows is returned, and the cursor stays open until it is exhausted
+        :param size: number of rows fetched at a time with 'fetchmany'
+        """
         if not conn:
             raise Exception("Connection is not established.")
 
@@ -57,6 +95,8 @@ class MSSQL:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
+            if fetch_method == 'fetchmany':
+                return self.fetch_many(cursor, size)
             if fetch_method == 'fetchone':
                 result = cursor.fetchone()
             else:
@@ -66,3 +106,20 @@ class MSSQL:
         except pyodbc.Error as e:
             self.logger.exception(f"Error executing query: {e}")
             raise e
+
+    def fetch_many(self, cursor, size):
+        """Yield the rows of an executed cursor in lists of at most size rows
+        :param cursor: cursor on which a query was executed
+        :param size: maximum number of rows in a list
+        """
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        except pyodbc.Error as e:
+            self.logger.exception(f"Error fetching rows: {e}")
+            raise e
+        finally:
+            cursor.close()
@@ -2,6 +2,7 @@ import time
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 oauth_url = 'Panopto/oauth2/connect/token'
@@ -23,6 +24,13 @@ class Panopto:
         self.session = requests.Session()
         self.session.trust_env = False
 
+        # keep-alive connections shared by the threads, blocking when all of them are in use
+        pool_size = config.get_value("connection_pool.max_size") or \
+            config.get_value("panopto_sync_thread_count")
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
         self.access_token = None
         self.expires_at = None
 
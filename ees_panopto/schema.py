@@ -63,6 +63,19 @@ schema = {
         'type': 'string',
         'empty': False
     },
+    'panopto_db.fetch_batch_size': {
+        'required': False,
+        'type': 'integer',
+        'default': 500,
+        'min': 1,
+        'max': 2000
+    },
+    'panopto_db.body_aggregation': {
+        'required': False,
+        'type': 'string',
+        'default': 'client',
+        'allowed': ['client', 'server']
+    },
     'fsd_search_db.host': {
         'required': True,
         'type': 'string',
@@ -191,6 +204,19 @@ schema = {
         'type': 'string',
         'empty': False
     },
+    'leadtools.engine_pool_size': {
+        'required': False,
+        'type': 'integer',
+        'nullable': True,
+        'default': None,
+        'min': 1
+    },
+    'leadtools.max_documents_per_engine': {
+        'required': False,
+        'type': 'integer',
+        'default': 100,
+        'min': 1
+    },
     'leadtools.common_module_python_path': {
         'required': True,
         'type': 'string',
@@ -228,12 +254,151 @@ schema = {
         'default': 5,
         'min': 1
     },
+    'text_extractor': {
+        'required': False,
+        'type': 'string',
+        'default': 'beautifulsoup',
+        'allowed': ['regex', 'beautifulsoup']
+    },
+    'panopto_partitions_per_thread': {
+        'required': False,
+        'type': 'integer',
+        'default': 8,
+        'min': 1
+    },
+    'incremental_sync_mode': {
+        'required': False,
+        'type': 'string',
+        'default': 'start_time',
+        'allowed': ['start_time', 'change_tracking']
+    },
+    'transform.process_count': {
+        'required': False,
+        'type': 'integer',
+        'default': 0,
+        'min': 0
+    },
+    'transform.chunk_size': {
+        'required': False,
+        'type': 'integer',
+        'default': 100,
+        'min': 1
+    },
+    'thumbnails.thread_count': {
+        'required': False,
+        'type': 'integer',
+        'default': 8,
+        'min': 1
+    },
+    'thumbnails.prebuild_index': {
+        'required': False,
+        'type': 'boolean',
+        'default': True
+    },
     'enterprise_search_sync_thread_count': {
         'required': False,
         'type': 'integer',
         'default': 5,
         'min': 1
     },
+    'connector_queue.max_size': {
+        'required': False,
+        'type': 'integer',
+        'default': 50,
+        'min': 0
+    },
+    'connector_queue.max_bytes': {
+        'required': False,
+        'type': 'integer',
+        'default': 256 * 1024 * 1024,
+        'min': 0
+    },
+    'connection_pool.min_size': {
+        'required': False,
+        'type': 'integer',
+        'default': 1,
+        'min': 0
+    },
+    'connection_pool.max_size': {
+        'required': False,
+        'type': 'integer',
+        'nullable': True,
+        'default': None,
+        'min': 1
+    },
+    'connection_pool.idle_timeout': {
+        'required': False,
+        'type': 'integer',
+        'default': 300,
+        'min': 1
+    },
+    'connection_pool.wait_timeout': {
+        'required': False,
+        'type': 'integer',
+        'default': 600,
+        'min': 1
+    },
+    'tika.endpoints': {
+        'required': False,
+        'type': 'list',
+        'default': ['http://localhost:9998/'],
+        'schema': {
+            'type': 'string',
+            'empty': False
+        }
+    },
+    'tika.max_concurrency': {
+        'required': False,
+        'type': 'integer',
+        'default': 8,
+        'min': 1
+    },
+    'tika.timeout': {
+        'required': False,
+        'type': 'integer',
+        'default': 300,
+        'min': 1
+    },
+    'tika.health_check_interval': {
+        'required': False,
+        'type': 'integer',
+        'default': 30,
+        'min': 1
+    },
+    'tika.pdf_min_page_text_length': {
+        'required': False,
+        'type': 'integer',
+        'default': 20,
+        'min': 0
+    },
+    'tika.pdf_ocr_workers': {
+        'required': False,
+        'type': 'integer',
+        'default': 4,
+        'min': 1
+    },
+    'extraction_cache.enabled': {
+        'required': False,
+        'type': 'boolean',
+        'default': True
+    },
+    'extraction_cache.path': {
+        'required': False,
+        'type': 'string',
+        'nullable': True,
+        'default': None
+    },
+    'extraction_cache.max_bytes': {
+        'required': False,
+        'type': 'integer',
+        'default': 1024 * 1024 * 1024,
+        'min': 1
+    },
+    'skip_unchanged_documents': {
+        'required': False,
+        'type': 'boolean',
+        'default': False
+    },
     'enable_document_permission': {
         'required': False,
         'type': 'boolean',
@@ -11,23 +11,66 @@ BATCH_SIZE = 100
 CONNECTION_TIMEOUT = 1000
 
 
+def delete_indexed_documents(elastic_search_custom_client, document_ids, timeout, local_storage=None,
+                             fingerprint_store=None):
+    """Deletes documents from the index, and forgets the ids of the deleted ones in the id map,
+    the local ids storage and the fingerprints
+    :param elastic_search_custom_client: ElasticSearchWrapper object
+    :param document_ids: dictionary of document id and Elasticsearch _id, None for the documents not indexed
+    :param timeout: Timeout in seconds
+    :param local_storage: LocalStorage object
+    :param fingerprint_store: FingerprintStore object
+    Returns:
+        documents_deleted: number of deleted documents
+        errors: list of failed deletions
+    """
+    indexed_document_ids = [document_id for document_id in document_ids.values() if document_id is not None]
+    documents_deleted, errors = 0, []
+    if indexed_document_ids:
+        documents_deleted, errors = elastic_search_custom_client.delete_documents(indexed_document_ids, timeout)
+
+    # the documents which failed to be deleted are kept, so that they are deleted again later
+    failed_document_ids = {error['delete'].get('_id') for error in errors}
+    deleted_ids = [item_id for item_id, document_id in document_ids.items()
+                   if document_id is None or document_id not in failed_document_ids]
+
+    elastic_search_custom_client.forget_document_ids(deleted_ids)
+    if local_storage:
+        local_storage.delete_ids("videos", deleted_ids)
+    if fingerprint_store:
+        fingerprint_store.forget(deleted_ids)
+    return documents_deleted, errors
+
+
 class SyncElasticSearch:
 
-    def __init__(self, config, logger, elastic_search_custom_client, queue):
+    def __init__(self, config, logger, elastic_search_custom_client, queue, fingerprint_store=None,
+                 local_storage=None):
         self.config = config
         self.logger = logger
         self.elastic_search_custom_client = elastic_search_custom_client
         self.queue = queue
+        self.fingerprint_store = fingerprint_store
+        self.local_storage = local_storage
         self.total_documents_indexed = 0
         self.total_documents_found = 0
         self.total_documents_failed = 0
 
         self.total_documents_appended = 0
         self.total_documents_updated = 0
+        self.total_documents_deleted = 0
 
     def index_documents(self, documents, upsert=False):
+        """Index a batch of documents
+        :param documents: list of documents
+        :param upsert: update the existing documents instead of replacing them
+        Returns:
+            succeeded: True if all the documents were indexed
+        """
+        succeeded = True
         if documents:
             self.total_documents_found += len(documents)
+            succeeded = False
 
             if upsert:
                 values = self.elastic_search_custom_client.index_documents_incremental(
@@ -43,6 +86,7 @@ class SyncElasticSearch:
                     self.total_documents_appended += documents_appended
                     self.total_documents_updated += documents_updated
 
+                    succeeded = not errors
                     if errors:
                         self.total_documents_failed += len(errors)
 
@@ -68,6 +112,7 @@ class SyncElasticSearch:
 
                     self.total_documents_indexed += documents_indexed
 
+                    succeeded = not errors
                     if errors:
                         self.total_documents_failed += len(errors)
 
@@ -84,6 +129,31 @@ class SyncElasticSearch:
                         f"[{threading.get_ident()}] Failed to index documents to the workplace"
                     )
 
+            # The fingerprints are only recorded when the whole batch was indexed,
+            # otherwise its documents are sent again on the next run
+            if self.fingerprint_store:
+                ids = [document['id'] for document in documents]
+                if succeeded:
+                    self.fingerprint_store.commit(ids)
+                else:
+                    self.fingerprint_store.discard(ids)
+
+        return succeeded
+
+    def delete_documents(self, ids):
+        """Delete documents from the index, and forget their id in the local stores
+        :param ids: ids of the documents
+        """
+        found_ids = self.elastic_search_custom_client.get_document_ids(ids)
+        documents_deleted, errors = delete_indexed_documents(
+            self.elastic_search_custom_client, {item_id: found_ids.get(item_id) for item_id in ids},
+            CONNECTION_TIMEOUT, self.local_storage, self.fingerprint_store)
+
+        self.total_documents_deleted += documents_deleted
+        self.total_documents_failed += len(errors)
+        for error in errors:
+            self.logger.error(f"Error while deleting. Error: {error}")
+
     def perform_sync(self, upsert=False):
         try:
             signal_open = True
@@ -92,23 +162,54 @@ class SyncElasticSearch:
             indexed out of: {self.total_documents_found} till now..")
             while signal_open:
                 documents_to_index = []
-                while len(documents_to_index) < BATCH_SIZE:
+                ids_to_delete = []
+                acknowledgements = []
+                while len(documents_to_index) < BATCH_SIZE and len(ids_to_delete) < BATCH_SIZE:
                     document = self.queue.get()
                     if document.get("type") == "signal_close":
                         self.logger.info(
                             f"Found an end signal in the queue. Closing Thread ID {threading.get_ident()}")
                         signal_open = False
                         break
+                    elif document.get("type") == "delete_list":
+                        ids_to_delete.extend(document.get("data"))
                     else:
                         documents_to_index.extend(document.get("data"))
+                        if document.get("acknowledge"):
+                            acknowledgements.append(document["acknowledge"])
+                succeeded = True
                 # This loop is to ensure if the last document fetched from the queue exceeds the size of
                 # documents_to_index to more than the permitted chunk size, then we split the documents as per the limit
                 for document_list in split_documents_into_equal_chunks(documents_to_index, BATCH_SIZE):
-                    self.index_documents(document_list, upsert)
+                    # A failing batch must not stop the thread, since the producers wait
+                    # for the consumers to make room in the bounded queue
+                    try:
+                        succeeded = self.index_documents(document_list, upsert) and succeeded
+                    except Exception as exception:
+                        succeeded = False
+                        self.logger.error(
+                            f"Error while indexing a batch of {len(document_list)} documents. Error: {exception}")
+                # The producers record the progress of their partitions once the documents are indexed
+                for acknowledge in acknowledgements:
+                    acknowledge(succeeded)
+
+                for id_list in split_documents_into_equal_chunks(ids_to_delete, BATCH_SIZE):
+                    try:
+                        self.delete_documents(id_list)
+                    except Exception as exception:
+                        self.logger.error(
+                            f"Error while deleting a batch of {len(id_list)} documents. Error: {exception}")
         except Exception as exception:
             self.logger.error(exception)
         self.logger.info(f"Thread ID: {threading.get_ident()} Total {self.total_documents_indexed} documents \
             indexed out of: {self.total_documents_found} till now..")
 
     def get_status(self):
-        return self.total_documents_found, self.total_documents_indexed, self.total_documents_appended, self.total_documents_updated, self.total_documents_failed
+        return (
+            self.total_documents_found,
+            self.total_documents_indexed,
+            self.total_documents_appended,
+            self.total_documents_updated,
+            self.total_documents_failed,
+            self.total_documents_deleted,
+        )
@@ -1,12 +1,15 @@
 import datetime
-import glob
 import html
+import html.entities
 import json
 import os
 import re
+import threading
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
 from pathlib import Path
+from types import SimpleNamespace
 from urllib.parse import urlparse
 
 import pyodbc
@@ -16,7 +19,11 @@ from bs4 import BeautifulSoup
 from tika import parser
 from tika.tika import TikaException
 
-from .utils import hash_id, is_website_url, run_tika
+from .constant import RFC_3339_DATETIME_FORMAT
+from .thumbnail_resolver import ThumbnailResolver
+from .utils import (hash_id, is_website_url, run_tika,
+                    split_date_range_by_density, split_date_range_into_chunks,
+                    split_documents_into_equal_chunks)
 
 requests.packages.urllib3.disable_warnings()
 
@@ -45,12 +52,12 @@ select
     [group].type as groupType
 from aclGroupEntry
     inner join delivery on delivery.aclID = aclGroupEntry.aclID
-    inner join session on session.id = delivery.sessionID and session.lifeCycleState = 0
+    inner join session on session.id = delivery.sessionID and session.lifeCycleState = 0 and session.deletedByUserKey is null
     inner join sessiongroup on sessiongroup.id = session.sessiongroupid
     inner join sessionTimes on sessionTimes.sessionId = session.id
     inner join [group] on [group].id = aclGroupEntry.groupID and [group].type = 6
     inner join lkp_PlayableObjectType on lkp_PlayableObjectType.id = session.playableObjectType and lkp_PlayableObjectType.id = 0 -- 0 = video, 1 = playlist
-where sessionTimes.startTime >= ? and sessionTimes.startTime <= ?
+where sessionTimes.startTime >= ? and sessionTimes.startTime < ?
 union all
 select 
     delivery.publicID,
@@ -67,59 +74,428 @@ select
 from aclGroupEntry
     inner join sessionGroup on sessionGroup.aclID = aclGroupEntry.aclID
     inner join session on session.sessionGroupId = sessionGroup.id
-    inner join delivery on delivery.sessioniD = session.id and session.lifeCycleState = 0
+    inner join delivery on delivery.sessioniD = session.id and session.lifeCycleState = 0 and session.deletedByUserKey is null
     inner join sessionTimes on sessionTimes.sessionId = session.id
     inner join [group] on [group].id = aclGroupEntry.groupID and [group].type = 6
     inner join lkp_PlayableObjectType on lkp_PlayableObjectType.id = session.playableObjectType and lkp_PlayableObjectType.id = 0 -- 0 = video, 1 = playlist
-where sessionTimes.startTime >= ? and sessionTimes.startTime <= ? 
+where sessionTimes.startTime >= ? and sessionTimes.startTime < ? 
+order by startTime
 """
 
-query_event_targets = f"""
+# Same videos, for a list of sessions instead of a range of start times
+query_videos_by_sessions = query_videos.replace(
+    "where sessionTimes.startTime >= ? and sessionTimes.startTime < ?", "where session.id in ({session_ids})")
+
+query_event_targets = """
 select
+    sessionID,
     ID as eventTargetId,
     eventTargetTypeID
 from eventTarget
 where
-    sessionID = ?
+    sessionID in ({session_ids})
+order by sessionID, ID
 """
 
-query_captions = f"""
+query_captions = """
 select 
-    data,
-    eventTargetId,
-    streamRelativeSeconds
+    caption.data,
+    caption.eventTargetId,
+    caption.streamRelativeSeconds
 from caption
+    inner join eventTarget on eventTarget.ID = caption.eventTargetId
 where 
-    eventTargetId = ?
-order by streamRelativeSeconds
+    eventTarget.sessionID in ({session_ids})
+order by caption.eventTargetId, caption.streamRelativeSeconds
 """
 
-query_events = f"""
+query_events = """
 select
-    caption,
-    eventTargetId,
-    time
+    event.caption,
+    event.eventTargetId,
+    event.time
 from event
+    inner join eventTarget on eventTarget.ID = event.eventTargetId
 where 
-    eventTargetId = ?
-order by time
+    eventTarget.sessionID in ({session_ids})
+order by event.eventTargetId, event.time
 """
 
-query_slides = f"""
+query_slides = """
 select
-    title,
-    content,
-    eventTargetId,
-    absoluteSeconds
+    slideEvent.title,
+    slideEvent.content,
+    slideEvent.eventTargetId,
+    slideEvent.absoluteSeconds
 from slideEvent
+    inner join eventTarget on eventTarget.ID = slideEvent.eventTargetId
 where 
-    eventTargetId = ?
-order by absoluteSeconds
+    eventTarget.sessionID in ({session_ids})
+order by slideEvent.eventTargetId, slideEvent.absoluteSeconds
+"""
+
+# One row per session with its texts concatenated in the same order as the client side assembly:
+# title, abstract, then captions, events and slides of each event target. Repeated texts only keep
+# their first occurrence. STRING_AGG requires SQL Server 2017 or later.
+query_session_bodies = """
+with session_texts as (
+    select session.id as sessionID, cast(session.longName as nvarchar(max)) as content,
+        0 as part, null as eventTargetId, 0 as kind, 0 as seconds, 0 as subPosition
+    from session
+    where session.id in ({session_ids})
+    union all
+    select session.id, cast(session.abstract as nvarchar(max)), 1, null, 0, 0, 0
+    from session
+    where session.id in ({session_ids})
+    union all
+    select eventTarget.sessionID, cast(caption.data as nvarchar(max)), 2, eventTarget.ID, 0,
+        caption.streamRelativeSeconds, 0
+    from caption
+        inner join eventTarget on eventTarget.ID = caption.eventTargetId
+    where eventTarget.sessionID in ({session_ids})
+    union all
+    select eventTarget.sessionID, cast(event.caption as nvarchar(max)), 2, eventTarget.ID, 1, event.time, 0
+    from event
+        inner join eventTarget on eventTarget.ID = event.eventTargetId
+    where eventTarget.sessionID in ({session_ids})
+    union all
+    select eventTarget.sessionID, cast(slideEvent.title as nvarchar(max)), 2, eventTarget.ID, 2,
+        slideEvent.absoluteSeconds, 0
+    from slideEvent
+        inner join eventTarget on eventTarget.ID = slideEvent.eventTargetId
+    where eventTarget.sessionID in ({session_ids})
+    union all
+    select eventTarget.sessionID, cast(slideEvent.content as nvarchar(max)), 2, eventTarget.ID, 2,
+        slideEvent.absoluteSeconds, 1
+    from slideEvent
+        inner join eventTarget on eventTarget.ID = slideEvent.eventTargetId
+    where eventTarget.sessionID in ({session_ids})
+),
+ordered_texts as (
+    select sessionID, content,
+        row_number() over (
+            partition by sessionID order by part, eventTargetId, kind, seconds, subPosition
+        ) as position
+    from session_texts
+    where content is not null and datalength(content) > 0
+),
+first_texts as (
+    select sessionID, content, position,
+        row_number() over (
+            partition by sessionID, hashbytes('SHA2_256', content) order by position
+        ) as occurrence
+    from ordered_texts
+)
+select
+    sessionID,
+    string_agg(content, nchar(10)) within group (order by position) as body
+from first_texts
+where occurrence = 1
+group by sessionID
+"""
+
+# Number of videos started on each day, used to split the sync into partitions of similar size.
+# The videos are counted with the joins and filters of query_videos, so that the partitions hold
+# about the same number of the videos which are fetched
+query_session_histogram = """
+select
+    bucket,
+    count(*) as total
+from (
+    select floor(videos.startTime / ?) as bucket
+    from (
+        select sessionTimes.startTime
+        from aclGroupEntry
+            inner join delivery on delivery.aclID = aclGroupEntry.aclID
+            inner join session on session.id = delivery.sessionID and session.lifeCycleState = 0 and session.deletedByUserKey is null
+            inner join sessiongroup on sessiongroup.id = session.sessiongroupid
+            inner join sessionTimes on sessionTimes.sessionId = session.id
+            inner join [group] on [group].id = aclGroupEntry.groupID and [group].type = 6
+            inner join lkp_PlayableObjectType on lkp_PlayableObjectType.id = session.playableObjectType and lkp_PlayableObjectType.id = 0 -- 0 = video, 1 = playlist
+        where sessionTimes.startTime >= ? and sessionTimes.startTime < ?
+        union all
+        select sessionTimes.startTime
+        from aclGroupEntry
+            inner join sessionGroup on sessionGroup.aclID = aclGroupEntry.aclID
+            inner join session on session.sessionGroupId = sessionGroup.id
+            inner join delivery on delivery.sessioniD = session.id and session.lifeCycleState = 0 and session.deletedByUserKey is null
+            inner join sessionTimes on sessionTimes.sessionId = session.id
+            inner join [group] on [group].id = aclGroupEntry.groupID and [group].type = 6
+            inner join lkp_PlayableObjectType on lkp_PlayableObjectType.id = session.playableObjectType and lkp_PlayableObjectType.id = 0 -- 0 = video, 1 = playlist
+        where sessionTimes.startTime >= ? and sessionTimes.startTime < ?
+    ) as videos
+) as videoBuckets
+group by bucket
+order by bucket
+"""
+
+# Public ids of all the videos the sync indexes, whatever their start time. They are sorted
+# by their binary value, which is the order of the bytes_le form of the uuids
+query_live_public_ids = """
+select liveVideos.publicID
+from (
+select delivery.publicID
+from aclGroupEntry
+    inner join delivery on delivery.aclID = aclGroupEntry.aclID
+    inner join session on session.id = delivery.sessionID and session.lifeCycleState = 0 and session.deletedByUserKey is null
+    inner join [group] on [group].id = aclGroupEntry.groupID and [group].type = 6
+where session.playableObjectType = 0
+union
+select delivery.publicID
+from aclGroupEntry
+    inner join sessionGroup on sessionGroup.aclID = aclGroupEntry.aclID
+    inner join session on session.sessionGroupId = sessionGroup.id and session.lifeCycleState = 0 and session.deletedByUserKey is null
+    inner join delivery on delivery.sessionID = session.id
+    inner join [group] on [group].id = aclGroupEntry.groupID and [group].type = 6
+where session.playableObjectType = 0
+) as liveVideos
+order by cast(liveVideos.publicID as binary(16))
+"""
+
+# Public ids of the videos of the sessions deleted or hidden, which the video query leaves out.
+# Panopto does not record when a session was deleted, so without change tracking the whole
+# history is read, and only the ids found in the local ids storage are deleted
+query_deleted_public_ids = """
+select delivery.publicID
+from session
+    inner join delivery on delivery.sessionID = session.id
+where session.lifeCycleState <> 0 or session.deletedByUserKey is not null
 """
 
+# Same videos, among a list of sessions changed since the last change tracking version
+query_deleted_public_ids_by_sessions = query_deleted_public_ids.replace(
+    "where session.lifeCycleState <> 0 or session.deletedByUserKey is not null",
+    "where session.id in ({session_ids}) and (session.lifeCycleState <> 0 or session.deletedByUserKey is not null)")
+
+# Tables whose changes make a session indexed again in the change_tracking incremental sync mode
+CHANGE_TRACKED_TABLES = ['session', 'delivery', 'caption', 'event', 'slideEvent']
+
+query_change_tracking_current_version = "select change_tracking_current_version() as version"
+
+query_change_tracking_min_valid_version = "select change_tracking_min_valid_version(object_id(?)) as version"
+
+# Sessions changed since a change tracking version, directly or through their deliveries,
+# captions, events and slides. Takes the version once for each table.
+# The changes only keep the primary key of a deleted row, so the session of a deleted caption,
+# event or slide can not be joined any more, and comes back as a null sessionID with the 'D'
+# operation. A deleted delivery only removes its own video, which the deletion sync finds
+query_changed_sessions = """
+select changes.id as sessionID, changes.SYS_CHANGE_OPERATION as operation
+from changetable(changes session, ?) as changes
+union
+select delivery.sessionID, changes.SYS_CHANGE_OPERATION as operation
+from changetable(changes delivery, ?) as changes
+    inner join delivery on delivery.id = changes.id
+union
+select eventTarget.sessionID, changes.SYS_CHANGE_OPERATION as operation
+from changetable(changes caption, ?) as changes
+    left join caption on caption.id = changes.id
+    left join eventTarget on eventTarget.ID = caption.eventTargetId
+union
+select eventTarget.sessionID, changes.SYS_CHANGE_OPERATION as operation
+from changetable(changes event, ?) as changes
+    left join event on event.id = changes.id
+    left join eventTarget on eventTarget.ID = event.eventTargetId
+union
+select eventTarget.sessionID, changes.SYS_CHANGE_OPERATION as operation
+from changetable(changes slideEvent, ?) as changes
+    left join slideEvent on slideEvent.id = changes.id
+    left join eventTarget on eventTarget.ID = slideEvent.eventTargetId
+"""
+
+# SQL Server accepts at most 2100 parameters, and the video query takes the session ids twice
+MAX_SESSIONS_PER_QUERY = 1000
+
+# The body query takes the session ids in each of the 6 parts of its union
+MAX_SESSIONS_PER_BODY_QUERY = 2000 // 6
+
+HISTOGRAM_BUCKET_SECONDS = 24 * 60 * 60
+
+# Markup and character references of an html fragment, read the way the html.parser of BeautifulSoup reads them
+HTML_MARKUP = re.compile(r"""
+    <!--.*?--\s*>                                       # comment
+  | <!\[CDATA\[(?P<cdata>.*?)\]\]>                      # CDATA section, whose content is text
+  | <(?P<raw_element>script|style)\b(?:=\s*(?:"[^"]*"|'[^']*'|(?!['"]))|[^>=])*>.*?</(?P=raw_element)\s*>
+  | <[a-zA-Z](?:=\s*(?:"[^"]*"|'[^']*'|(?!['"]))|[^>=])*>  # start tag, a > may be quoted in its attribute values
+  | <[a-zA-Z][^>]*>                                     # start tag with an unmatched quote
+  | </[^>]*>                                            # end tag, whatever it holds
+  | <!(?!--)[^>]*>                                      # declaration or marked section
+  | <\?[^>]*>                                           # processing instruction
+  | &\#(?P<charref>[0-9]+|[xX][0-9a-fA-F]+)(?=[^0-9a-fA-F]);?
+  | &(?P<entityref>[a-zA-Z][-.a-zA-Z0-9]*)(?=[^a-zA-Z0-9]);?
+  | &(?=[a-zA-Z]\Z)                                    # dropped before a last letter of the text
+""", re.IGNORECASE | re.DOTALL | re.VERBOSE)
+
+# Panopto stores the times as seconds since this date
+PANOPTO_BASE_DATE = datetime.datetime(1600, 12, 31)
+
+video_url_template = '{host}//Panopto/Pages/Viewer.aspx?id={public_id}'
+
 thumbnail_root_dir = r'\\10.18.25.144\Web'
 
 
+def to_panopto_time(time):
+    """Convert a time in rfc 3339 format to the number of seconds used by Panopto
+    :param time: time in rfc 3339 format
+    """
+    date_time = datetime.datetime.strptime(time, RFC_3339_DATETIME_FORMAT)
+    return (date_time - PANOPTO_BASE_DATE).total_seconds()
+
+
+def replace_markup(match):
+    """Returns the text of a match of HTML_MARKUP: the content of a CDATA section, the character of a
+    reference, or nothing for the markup. An unknown entity is kept without its semicolon, as BeautifulSoup does
+    :param match: match of HTML_MARKUP
+    """
+    if match.group('cdata') is not None:
+        return match.group('cdata')
+    if match.group('charref') is not None:
+        return html.unescape(f"&#{match.group('charref')};")
+    if match.group('entityref') is not None:
+        return html.entities.html5.get(f"{match.group('entityref')};", f"&{match.group('entityref')}")
+    return ''
+
+
+def strip_html(fragment):
+    """Returns the text of an html fragment, without its tags and with its entities unescaped
+    :param fragment: html fragment, like a caption or the content of a slide
+    """
+    if '<' in fragment or '&' in fragment:
+        return HTML_MARKUP.sub(replace_markup, fragment)
+    return fragment
+
+
+def from_panopto_time(seconds):
+    """Convert a number of seconds used by Panopto to a time in rfc 3339 format
+    :param seconds: seconds since the Panopto base date
+    """
+    date_time = PANOPTO_BASE_DATE + datetime.timedelta(seconds=seconds)
+    return date_time.strftime(RFC_3339_DATETIME_FORMAT)
+
+
+class DocumentBuilder:
+    """This class builds the documents from the rows of the videos and the texts of their sessions.
+    It only holds settings, so that it can be sent to the processes of the transform stage."""
+
+    def __init__(self, host, categories, body_aggregation, text_extractor):
+        self.host = host
+        self.categories = categories
+        self.body_aggregation = body_aggregation
+        self.text_extractor = text_extractor
+
+    def build_documents(self, video_batch, session_texts):
+        """Build the documents of a block of videos
+        :param video_batch: list of rows of the video query
+        :param session_texts: dictionary of session id and either the html body of the session, when
+            the bodies are aggregated by the server, or the ordered list of texts of the session
+        """
+        docs = []
+        for video in video_batch:
+            if self.body_aggregation == 'server':
+                body = self.extract_text(session_texts.get(video.sessionID, ''))
+            else:
+                contents = [video.longName, video.abstract]
+                contents.extend(session_texts.get(video.sessionID, []))
+                body = self.build_body(contents)
+            docs.append(self.build_document(video, body))
+        return docs
+
+    def get_video_url(self, public_id):
+        url = video_url_template.format(host=self.host, public_id=public_id)
+        return url
+
+    @staticmethod
+    def assemble_body(contents, normalize=None):
+        """Join the texts of a session into its body, skipping empty and repeated texts
+        :param contents: ordered list of texts of the session
+        :param normalize: function applied to each text before they are joined
+        """
+        contents = dict.fromkeys(filter(lambda item: item is not None and len(item) > 0, contents))
+        if normalize:
+            return '\n'.join(map(normalize, contents))
+        return '\n'.join(contents)
+
+    def build_body(self, contents):
+        """Build the text body of a session from its ordered html texts. With the regex extractor each
+        text is stripped on its own, instead of parsing the whole joined body
+        :param contents: ordered list of texts of the session
+        """
+        if self.text_extractor == 'regex':
+            return self.assemble_body(contents, strip_html)
+        return self.extract_text(self.assemble_body(contents))
+
+    def extract_text(self, html_body):
+        """Returns the text of an html body with the configured text extractor
+        :param html_body: html body of a session
+        """
+        if self.text_extractor == 'regex':
+            return strip_html(html_body or '')
+        return BeautifulSoup(html_body or '', 'html.parser').get_text()
+
+    def build_document(self, video, body):
+        """Build the document of a video
+        :param video: row of the video query
+        :param body: text body of the session of the video
+        """
+        public_id = video.publicID
+
+        doc = {}
+        url = self.get_video_url(public_id)
+
+        doc['category'] = self.get_category(url)
+
+        doc['id'] = public_id
+        doc['date'] = from_panopto_time(video.startTime)
+        doc['title'] = video.longName
+        doc['path'] = url
+        doc['url'] = url
+        doc['public_id'] = public_id
+        doc['body'] = ''
+        doc['_allow_permissions'] = []
+
+        # self.panopto_client.dowload_video_by_session_id(public_id)
+
+        doc['body'] = body
+
+        # source
+        doc['source'] = 'training'
+
+        return doc
+
+    def get_category(self, url):
+        """Get the file type hierarchy of the given filename."""
+        ext = os.path.splitext(url)[-1].lower()
+
+        if ext in ['.xls', '.xlsx', '.xlsm', '.xlsb']:
+            return ['xlsx', ext[1:]]
+        elif ext in ['.doc', '.docx', '.docm']:
+            return ['docx', ext[1:]]
+        elif ext in ['.ppt', '.pptx', '.pptm']:
+            return ['pptx', ext[1:]]
+
+        # example: ['image', ext[1:]] if ['.jpg', '.jpeg', '.png', '.bmp', '.gif'], ['video', ext[1:]] if ['.mp4', '.avi', '.mov', '.wmv']
+
+        if self.categories:
+            for parent, children in self.categories.items():
+                for child in children:
+                    if child == ext[1:]:
+                        return [parent, ext[1:]]
+
+        if is_website_url(url):
+            return ['link']
+
+        return [ext[1:]]
+
+
+def build_documents_in_process(document_builder, video_batch, session_texts):
+    """Entry point of the processes of the transform stage
+    :param document_builder: DocumentBuilder object
+    :param video_batch: list of the video rows, converted to SimpleNamespace objects
+    :param session_texts: texts of the sessions of the videos
+    """
+    return document_builder.build_documents(video_batch, session_texts)
+
+
 class SyncPanopto:
     def __init__(
         self,
@@ -132,6 +508,9 @@ class SyncPanopto:
         panopto_client,
         start_time=None,
         end_time=None,
+        fingerprint_store=None,
+        local_storage=None,
+        partition_checkpoint=None,
     ):
         self.logger = logger
         self.config = config
@@ -143,180 +522,398 @@ class SyncPanopto:
         self.leadtools_engine = leadtools_engine
         self.panopto_client = panopto_client
         self.fsd_search_portal_client = config.fsd_search_portal_client
+        self.fingerprint_store = fingerprint_store
+        self.local_storage = local_storage
+        self.partition_checkpoint = partition_checkpoint
 
         self.host = config.get_value("panopto.host_url")
         self.thumbnail_root_url = f'{self.host}/Panopto/Content/Sessions'
+        self.thumbnail_resolver = ThumbnailResolver(
+            logger,
+            thumbnail_root_dir,
+            config.get_value("thumbnails.thread_count"),
+            config.get_value("thumbnails.prebuild_index"),
+        )
 
         # for incremental sync
         self.start_time = start_time
         self.end_time = end_time
 
         self.categories = config.get_value("categories")
-
-    def get_video_url(self, public_id):
-        url = f'{self.host}//Panopto/Pages/Viewer.aspx?id={public_id}'
-        return url
+        self.fetch_batch_size = config.get_value("panopto_db.fetch_batch_size")
+        self.body_aggregation = config.get_value("panopto_db.body_aggregation")
+        self.document_builder = DocumentBuilder(
+            self.host, self.categories, self.body_aggregation, config.get_value("text_extractor"))
+
+        # The documents are built in separate processes when the transform stage is enabled,
+        # since the producer threads share a single interpreter lock. The processes are only
+        # started with the first block of videos, a run without any video does not pay for them
+        self.transform_chunk_size = config.get_value("transform.chunk_size")
+        self.transform_process_count = config.get_value("transform.process_count")
+        self.transform_executor = None
+        self.transform_executor_lock = threading.Lock()
+
+    def get_date_partitions(self, start_time, end_time, number_of_partitions):
+        """Split the time range into half-open partitions [start, end) holding about the same number
+        of videos, based on the number of videos started each day
+        :param start_time: start time of the range
+        :param end_time: end time of the range
+        :param number_of_partitions: number of partitions to create
+        Returns:
+            partitions: list of tuples of start time and end time
+        """
+        try:
+            with self.mssql_client.connection() as conn:
+                buckets = self.mssql_client.execute_query(
+                    conn, query_session_histogram,
+                    (HISTOGRAM_BUCKET_SECONDS, to_panopto_time(start_time), to_panopto_time(end_time),
+                     to_panopto_time(start_time), to_panopto_time(end_time)))
+
+            histogram = [(from_panopto_time(int(bucket.bucket) * HISTOGRAM_BUCKET_SECONDS), bucket.total)
+                         for bucket in buckets]
+            return split_date_range_by_density(start_time, end_time, histogram, number_of_partitions)
+        except Exception as exception:
+            self.logger.exception(
+                f"Error while counting the sessions, splitting the time range in equal intervals. Error: {exception}")
+            datelist = split_date_range_into_chunks(start_time, end_time, number_of_partitions)
+            # a window shorter than the number of partitions gives repeated boundaries, so the empty
+            # and repeated ranges are dropped, each partition being recorded on its own by the checkpoint
+            partitions = [(datelist[num], datelist[num + 1]) for num in range(0, number_of_partitions)]
+            return list(dict.fromkeys(
+                (partition_start, partition_end) for partition_start, partition_end in partitions
+                if partition_start < partition_end))
 
     def fetch_videos(self, duration):
-        start_time, end_time = duration[0], duration[1]
-        base_date = datetime.datetime(1600, 12, 31)
-
-        start_date_time = datetime.datetime.strptime(
-            start_time, "%Y-%m-%dT%H:%M:%SZ")
-        time_difference = start_date_time - base_date
-        start_time = time_difference.total_seconds()
-
-        end_date_time = datetime.datetime.strptime(
-            end_time, "%Y-%m-%dT%H:%M:%SZ")
-        time_difference = end_date_time - base_date
-        end_time = time_difference.total_seconds()
-
-        docs = []
-
-        conn = self.mssql_client.connect()
-        videos = self.mssql_client.execute_query(
-            conn, query_videos, (start_time, end_time, start_time, end_time))
-
-        self.logger.info(f'Fetching videos from {start_time} to {end_time}')
-
-        for video in videos:
-            public_id = video.publicID
-            session_public_id = video.sessionPublicID
-            group_type = video.groupType
-
-            doc = {}
-            url = self.get_video_url(public_id)
-
+        """Yield the documents of the videos started within the duration, one block at a time
+        :param duration: tuple of start time and end time, the end time being excluded so that
+            the neighbouring partitions do not fetch the sessions started on their boundary twice
+        """
+        start_time, end_time = to_panopto_time(duration[0]), to_panopto_time(duration[1])
+
+        # The video rows are streamed on their own connection, since a connection cannot run
+        # the queries of the captions, events and slides while it still has pending results
+        with self.mssql_client.connection() as videos_conn, self.mssql_client.connection() as contents_conn:
+            video_batches = self.mssql_client.execute_query(
+                videos_conn, query_videos, (start_time, end_time, start_time, end_time),
+                fetch_method='fetchmany', size=self.fetch_batch_size)
+
+            self.logger.info(f'Fetching videos from {start_time} to {end_time}')
+
+            try:
+                for video_batch in video_batches:
+                    yield self.build_documents(contents_conn, video_batch)
+            finally:
+                # close the cursor before its connection goes back to the pool
+                video_batches.close()
+
+    def get_change_tracking_versions(self):
+        """Returns the current change tracking version of the database, and the oldest version from
+        which the changes of all the tracked tables are still available
+        """
+        with self.mssql_client.connection() as conn:
+            current_version = self.mssql_client.execute_query(
+                conn, query_change_tracking_current_version, fetch_method='fetchone').version
+            min_valid_versions = [
+                self.mssql_client.execute_query(
+                    conn, query_change_tracking_min_valid_version, (table,), fetch_method='fetchone').version
+                for table in CHANGE_TRACKED_TABLES
+            ]
+
+        if current_version is None or None in min_valid_versions:
+            raise Exception(
+                f"Change tracking is not enabled on the database or on one of the tables {CHANGE_TRACKED_TABLES}")
+        return current_version, max(min_valid_versions)
+
+    def get_changed_session_ids(self, version):
+        """Returns the ids of the sessions changed since a change tracking version. Raises an exception
+        when captions, events or slides were deleted, since their sessions can not be found any more
+        :param version: change tracking version of the last sync
+        """
+        session_ids = []
+        has_deleted_rows = False
+        with self.mssql_client.connection() as conn:
+            batches = self.mssql_client.execute_query(
+                conn, query_changed_sessions, (version,) * len(CHANGE_TRACKED_TABLES),
+                fetch_method='fetchmany', size=self.fetch_batch_size)
+            for batch in batches:
+                for row in batch:
+                    if row.sessionID is not None:
+                        session_ids.append(row.sessionID)
+                    elif row.operation == 'D':
+                        has_deleted_rows = True
+
+        if has_deleted_rows:
+            raise Exception(
+                f"Captions, events or slides were deleted since the change tracking version {version}, "
+                f"their sessions can not be found from the changes")
+        # a session changed through several tables is listed once for each operation
+        session_ids = list(dict.fromkeys(session_ids))
+        self.logger.info(f"Found {len(session_ids)} sessions changed since the change tracking version {version}")
+        return session_ids
+
+    def fetch_videos_by_sessions(self, session_ids):
+        """Yield the documents of the videos of a list of sessions, one block at a time
+        :param session_ids: list of at most MAX_SESSIONS_PER_QUERY session ids
+        """
+        placeholders = ', '.join(['?'] * len(session_ids))
+
+        with self.mssql_client.connection() as videos_conn, self.mssql_client.connection() as contents_conn:
+            video_batches = self.mssql_client.execute_query(
+                videos_conn, query_videos_by_sessions.format(session_ids=placeholders), session_ids * 2,
+                fetch_method='fetchmany', size=self.fetch_batch_size)
+
+            try:
+                for video_batch in video_batches:
+                    yield self.build_documents(contents_conn, video_batch)
+            finally:
+                video_batches.close()
+
+    def sync_deleted_videos(self, session_ids=None):
+        """Send the ids of the indexed videos whose session was deleted or hidden to the consumers,
+        so that they are removed from the index. Only the ids found in the local ids storage are sent,
+        and they are removed from it once deleted, so each deletion is only sent once
+        :param session_ids: ids of the sessions changed since the last change tracking version, None to
+            look for the deleted sessions in the whole history
+        Returns:
+            total_deleted_videos: number of ids sent to the queue
+        """
+        if session_ids is None:
+            queries = [(query_deleted_public_ids, ())]
+        else:
+            queries = [
+                (query_deleted_public_ids_by_sessions.format(session_ids=', '.join(['?'] * len(session_batch))),
+                 session_batch)
+                for session_batch in split_documents_into_equal_chunks(session_ids, MAX_SESSIONS_PER_QUERY)
+            ]
+
+        total_deleted_videos = 0
+        with self.mssql_client.connection() as conn:
+            for query, params in queries:
+                id_batches = self.mssql_client.execute_query(
+                    conn, query, params, fetch_method='fetchmany', size=self.fetch_batch_size)
+                for id_batch in id_batches:
+                    ids = self.local_storage.get_existing_ids("videos", [row.publicID for row in id_batch])
+                    total_deleted_videos += len(ids)
+                    self.queue.append_delete_list(ids)
+
+        self.logger.info(f"Found {total_deleted_videos} deleted or hidden videos to remove from the index")
+        return total_deleted_videos
+
+    def build_documents(self, conn, video_batch):
+        """Build the documents of a block of videos. The captions, events and slides are loaded
+        for the whole block at once, so the number of round trips depends on the number of blocks,
+        not on the number of videos
+        :param conn: MSSQL connection
+        :param video_batch: list of rows of the video query
+        """
+        session_ids = [video.sessionID for video in video_batch]
+
+        # The thumbnails are looked up on the share while the contents are fetched
+        thumbnails = self.thumbnail_resolver.resolve([video.sessionPublicID for video in video_batch])
+
+        if self.body_aggregation == 'server':
+            session_texts = self.fetch_session_bodies(conn, session_ids)
+        else:
+            session_texts = self.fetch_session_contents(conn, session_ids)
+
+        if self.transform_process_count:
+            docs = self.transform_documents(video_batch, session_texts)
+        else:
+            docs = self.document_builder.build_documents(video_batch, session_texts)
+
+        for video, doc in zip(video_batch, docs):
             self.logger.info(
-                f'Fetching video from {url} with public id {public_id}, session public id {session_public_id}, group type {group_type}')
-
-            doc['category'] = self.get_category(url)
-
-            date_time = base_date + datetime.timedelta(seconds=video.startTime)
-
-            doc['id'] = public_id
-            doc['date'] = date_time.isoformat(timespec='seconds') + 'Z'
-            doc['title'] = video.longName
-            doc['path'] = url
-            doc['url'] = url
-            doc['public_id'] = public_id
-            doc['body'] = ''
-            doc['_allow_permissions'] = []
-
-            contents = []
-            contents.append(video.longName)
-            contents.append(video.abstract)
-
-            event_targets = self.mssql_client.execute_query(
-                conn, query_event_targets, (video.sessionID))
-
-            for event_target in event_targets:
-                event_target_id = event_target.eventTargetId
-                type_id = event_target.eventTargetTypeID
-
-                # TRANSCRIPT, MACHINE_TRANSCRIPT, USER_CREATED_TRANSCRIPT
-                captions = self.mssql_client.execute_query(
-                    conn, query_captions, (event_target_id))
-
-                for caption in captions:
-                    data = caption.data
-                    contents.append(data)
-
-                # PRIMARY
-                events = self.mssql_client.execute_query(
-                    conn, query_events, (event_target_id))
-
-                for event in events:
-                    caption = event.caption
-                    contents.append(caption)
-
-                # POWERPOINT
-                slides = self.mssql_client.execute_query(
-                    conn, query_slides, (event_target_id))
-                for slide in slides:
-                    slide_title = slide.title
-
-                    if slide_title:
-                        contents.append(slide_title)
-
-                    slide_content = slide.content
-                    if slide_content:
-                        contents.append(slide_content)
-
-            thumbnail_folder_path = thumbnail_root_dir + \
-                f'/{session_public_id}/*_et/thumbs/*.jpg'
-            thumbnail_paths = glob.glob(thumbnail_folder_path)
-            thumbnail_paths = sorted(
-                thumbnail_paths, key=lambda x: os.path.basename(x).lower())
-
-            if thumbnail_paths:
-                thumbnail_path = thumbnail_paths[0]
-                relative_path = thumbnail_path.replace(
-                    r'\\10.18.25.144\Web', '').replace('\\', '/')
-                thumbnail_url = self.thumbnail_root_url + relative_path
-                doc['thumbnail'] = thumbnail_url
-            else:
-                doc['thumbnail'] = ''
-
-            # self.panopto_client.dowload_video_by_session_id(public_id)
+                f'Fetching video from {doc["url"]} with public id {video.publicID}, '
+                f'session public id {video.sessionPublicID}, group type {video.groupType}')
 
-            contents = list(
-                filter(lambda item: item is not None and len(item) > 0, contents))
-            html_string = '\n'.join(
-                list(dict.fromkeys(contents))) + doc['body']
-            soup = BeautifulSoup(html_string, 'html.parser')
-            doc['body'] = soup.get_text()
+        for video, doc in zip(video_batch, docs):
+            doc['thumbnail'] = self.get_thumbnail_url(thumbnails[video.sessionPublicID])
 
-            # source
-            doc['source'] = 'training'
+        # click count
+        click_counts = self.fsd_search_portal_client.get_click_counts(
+            [doc['url'] for doc in docs])
+        for doc in docs:
+            doc['click_count'] = click_counts[doc['url']]
 
-            # click count
-            doc['click_count'] = self.fsd_search_portal_client.get_click_count(
-                doc['url'])
-
-            docs.append(doc)
-
-        conn.close()
         return docs
 
-    def get_category(self, url):
-        """Get the file type hierarchy of the given filename."""
-        ext = os.path.splitext(url)[-1].lower()
+    def transform_documents(self, video_batch, session_texts):
+        """Build the documents of a block of videos in the processes of the transform stage,
+        in chunks of transform.chunk_size videos
+        :param video_batch: list of rows of the video query
+        :param session_texts: texts of the sessions of the videos
+        """
+        futures = []
+        for chunk in split_documents_into_equal_chunks(video_batch, self.transform_chunk_size):
+            # the pyodbc rows can not be pickled
+            videos = [SimpleNamespace(**{column[0]: value for column, value in zip(video.cursor_description, video)})
+                      for video in chunk]
+            texts = {video.sessionID: session_texts[video.sessionID]
+                     for video in videos if video.sessionID in session_texts}
+            futures.append(self.get_transform_executor().submit(
+                build_documents_in_process, self.document_builder, videos, texts))
 
-        if ext in ['.xls', '.xlsx', '.xlsm', '.xlsb']:
-            return ['xlsx', ext[1:]]
-        elif ext in ['.doc', '.docx', '.docm']:
-            return ['docx', ext[1:]]
-        elif ext in ['.ppt', '.pptx', '.pptm']:
-            return ['pptx', ext[1:]]
-
-        # example: ['image', ext[1:]] if ['.jpg', '.jpeg', '.png', '.bmp', '.gif'], ['video', ext[1:]] if ['.mp4', '.avi', '.mov', '.wmv']
+        docs = []
+        for future in futures:
+            docs.extend(future.result())
+        return docs
 
-        if self.categories:
-            for parent, children in self.categories.items():
-                for child in children:
-                    if child == ext[1:]:
-                        return [parent, ext[1:]]
+    def get_transform_executor(self):
+        """Returns the process pool of the transform stage, started by the first producer thread calling it"""
+        with self.transform_executor_lock:
+            if self.transform_executor is None:
+                self.transform_executor = ProcessPoolExecutor(max_workers=self.transform_process_count)
+            return self.transform_executor
+
+    def close(self):
+        """Stops the thumbnail threads and the transform processes, if they were started"""
+        self.thumbnail_resolver.close()
+        with self.transform_executor_lock:
+            transform_executor, self.transform_executor = self.transform_executor, None
+        if transform_executor:
+            transform_executor.shutdown(wait=True)
+
+    def get_thumbnail_url(self, thumbnail):
+        """Returns the url of the thumbnail of a video, or an empty string if it has none
+        :param thumbnail: future of the path of the thumbnail on the share
+        """
+        try:
+            thumbnail_path = thumbnail.result()
+        except Exception as exception:
+            self.logger.error(f"Error while resolving a thumbnail. Error: {exception}")
+            return ''
+
+        if not thumbnail_path:
+            return ''
+        relative_path = thumbnail_path.replace(
+            r'\\10.18.25.144\Web', '').replace('\\', '/')
+        return self.thumbnail_root_url + relative_path
+
+    def fetch_session_contents(self, conn, session_ids):
+        """Fetch the captions, events and slides of a block of sessions with one query per table
+        :param conn: MSSQL connection
+        :param session_ids: list of session ids
+        Returns:
+            session_contents: dictionary of session id and the ordered list of texts of the session
+        """
+        session_ids = list(dict.fromkeys(session_ids))
+        placeholders = ', '.join(['?'] * len(session_ids))
+
+        event_targets = self.mssql_client.execute_query(
+            conn, query_event_targets.format(session_ids=placeholders), session_ids)
+
+        # TRANSCRIPT, MACHINE_TRANSCRIPT, USER_CREATED_TRANSCRIPT
+        captions = self.group_by_event_target(self.mssql_client.execute_query(
+            conn, query_captions.format(session_ids=placeholders), session_ids),
+            lambda caption: [caption.data])
+
+        # PRIMARY
+        events = self.group_by_event_target(self.mssql_client.execute_query(
+            conn, query_events.format(session_ids=placeholders), session_ids),
+            lambda event: [event.caption])
+
+        # POWERPOINT
+        slides = self.group_by_event_target(self.mssql_client.execute_query(
+            conn, query_slides.format(session_ids=placeholders), session_ids),
+            lambda slide: [slide.title, slide.content])
+
+        session_contents = {}
+        for event_target in event_targets:
+            event_target_id = event_target.eventTargetId
+            contents = session_contents.setdefault(event_target.sessionID, [])
+            contents.extend(captions.get(event_target_id, []))
+            contents.extend(events.get(event_target_id, []))
+            contents.extend(slides.get(event_target_id, []))
+
+        return session_contents
+
+    def fetch_session_bodies(self, conn, session_ids):
+        """Fetch the bodies of a block of sessions, concatenated by SQL Server
+        :param conn: MSSQL connection
+        :param session_ids: list of session ids
+        Returns:
+            session_bodies: dictionary of session id and the html body of the session
+        """
+        session_ids = list(dict.fromkeys(session_ids))
+        session_bodies = {}
+        # the session ids are used by each part of the union of the query, so a block of videos
+        # larger than MAX_SESSIONS_PER_BODY_QUERY sessions is queried in several parts
+        for start in range(0, len(session_ids), MAX_SESSIONS_PER_BODY_QUERY):
+            chunk = session_ids[start:start + MAX_SESSIONS_PER_BODY_QUERY]
+            placeholders = ', '.join(['?'] * len(chunk))
+            rows = self.mssql_client.execute_query(
+                conn, query_session_bodies.format(session_ids=placeholders), chunk * 6)
+            session_bodies.update((row.sessionID, row.body) for row in rows)
+
+        return session_bodies
+
+    @staticmethod
+    def group_by_event_target(rows, get_texts):
+        """Group the texts of the rows by their event target id, keeping the order of the rows
+        :param rows: rows having an eventTargetId column
+        :param get_texts: function returning the list of texts of a row
+        """
+        texts = {}
+        for row in rows:
+            texts.setdefault(row.eventTargetId, []).extend(get_texts(row))
+        return texts
+
+    def queue_documents(self, fetched_documents, ids_storage, acknowledge=None):
+        """Records the ids of a block of documents and pushes the changed ones to the queue
+        :param fetched_documents: list of documents
+        :param ids_storage: dictionary of the ids and urls of the fetched documents
+        :param acknowledge: function called once the documents are indexed
+        """
+        for doc in fetched_documents:
+            ids_storage.update({doc["id"]: doc["url"]})
 
-        if is_website_url(url):
-            return ['link']
+        # Documents identical to their last indexed version are not sent again
+        if self.fingerprint_store:
+            fetched_documents = self.fingerprint_store.filter_changed(fetched_documents)
 
-        return [ext[1:]]
+        self.queue.append_to_queue(fetched_documents, acknowledge)
 
     def perform_sync(self, date_ranges):
-        documents_to_index = []
         ids_storage = {}
+        fetched = True
 
         try:
-            fetched_documents = self.fetch_videos(date_ranges)
-
-            self.queue.append_to_queue(fetched_documents)
-            documents_to_index.extend(fetched_documents)
+            # Each block of documents is pushed as soon as it is built, so the consumers
+            # index it while the next block is fetched
+            for fetched_documents in self.fetch_videos(date_ranges):
+                # The videos are sorted by start time, so a resumed partition starts after the
+                # last block of the partition which was indexed
+                acknowledge = None
+                if self.partition_checkpoint and fetched_documents:
+                    acknowledge = self.partition_checkpoint.add_block(
+                        date_ranges, max(doc["date"] for doc in fetched_documents))
+
+                self.queue_documents(fetched_documents, ids_storage, acknowledge)
         except Exception as exception:
+            fetched = False
             self.logger.error(
                 f"Error while fetching videos. Error: {exception}")
 
-        for doc in documents_to_index:
-            ids_storage.update({doc["id"]: doc["url"]})
+        # The ids of each partition are committed as soon as it is fetched
+        if self.local_storage:
+            self.local_storage.upsert_ids("videos", ids_storage)
+
+        if self.partition_checkpoint:
+            self.partition_checkpoint.finish_fetching(date_ranges, fetched)
+
+        return ids_storage
+
+    def perform_sync_sessions(self, session_ids):
+        """Fetch the videos of a list of changed sessions and push their documents to the queue.
+        Raises the errors, so that the change tracking version is not moved past the failed sessions
+        :param session_ids: list of at most MAX_SESSIONS_PER_QUERY session ids
+        """
+        ids_storage = {}
+        try:
+            for fetched_documents in self.fetch_videos_by_sessions(session_ids):
+                self.queue_documents(fetched_documents, ids_storage)
+        finally:
+            if self.local_storage:
+                self.local_storage.upsert_ids("videos", ids_storage)
 
         return ids_storage
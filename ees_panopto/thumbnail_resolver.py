@@ -0,0 +1,220 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""thumbnail_resolver module allows to find the thumbnail of a session without listing the share for each video.
+
+    The first thumbnail of each session folder is kept in a persistent index, built with one scan
+    of the thumbnails root folder the first time a session is missing from it. Later scans only
+    look into the session folders whose modification time changed, so each lookup is a dictionary access.
+
+    The thumbnails are resolved on a thread pool of their own, so that the producers keep
+    fetching the videos while the share answers.
+"""
+import fnmatch
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+THUMBNAIL_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'thumbnail_index.json')
+
+
+class ThumbnailResolver:
+    """This class resolves the first thumbnail of a session, from the folders
+    {root_dir}/{session_public_id}/*_et/thumbs/*.jpg"""
+
+    def __init__(self, logger, root_dir, thread_count=8, prebuild_index=True, index_path=THUMBNAIL_INDEX_PATH):
+        """
+        :param logger: logger object
+        :param root_dir: thumbnails root folder
+        :param thread_count: number of threads resolving the thumbnails
+        :param prebuild_index: refresh the index of the whole root folder on the first session missing
+            from it, otherwise each session folder is checked when it is looked up
+        :param index_path: path of the index file
+        """
+        self.logger = logger
+        self.root_dir = root_dir
+        self.index_path = index_path
+        self.prebuild_index = prebuild_index
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.changed = False
+        self.is_refresh_started = False
+        self.is_refreshed = False
+        self.index = self.load()
+        # thumbnails of the sessions resolved during this run, None for the sessions without any
+        self.resolved = {}
+
+        self.executor = ThreadPoolExecutor(max_workers=thread_count)
+
+    def load(self):
+        """Loads the index of the thumbnails root folder from the index file"""
+        try:
+            with open(self.index_path, encoding='utf-8') as index_file:
+                return json.load(index_file).get(self.root_dir, {})
+        except FileNotFoundError:
+            self.logger.debug(f"Thumbnail index file not found on path: {self.index_path}")
+        except ValueError as exception:
+            self.logger.exception(
+                f"Error while parsing the thumbnail index file from path: {self.index_path}. Error: {exception}")
+        return {}
+
+    def save(self):
+        """Writes the index to the index file if it changed"""
+        with self.lock:
+            if not self.changed:
+                return
+            index = dict(self.index)
+            self.changed = False
+
+        # written to a temporary file first, so an interrupted run does not leave a truncated index
+        temporary_path = self.index_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as index_file:
+            json.dump({self.root_dir: index}, index_file)
+        os.replace(temporary_path, self.index_path)
+        self.logger.info(f"Saved the thumbnails of {len(index)} sessions")
+
+    def scan_session(self, session_public_id, session_mtime):
+        """Lists the thumbnails of a session folder and returns its index entry
+        :param session_public_id: public id of the session, name of its folder
+        :param session_mtime: modification time of the session folder
+        """
+        session_dir = f'{self.root_dir}/{session_public_id}'
+        thumbnails = []
+        # modification times of the thumbnail folders, to notice the thumbnails added later to them
+        folder_mtimes = {}
+        try:
+            with os.scandir(session_dir) as entries:
+                et_folders = [entry.name for entry in entries
+                              if fnmatch.fnmatch(entry.name, '*_et') and entry.is_dir()]
+        except OSError:
+            et_folders = []
+
+        for et_folder in et_folders:
+            thumbs_dir = f'{session_dir}/{et_folder}/thumbs'
+            try:
+                folder_mtimes[thumbs_dir] = os.stat(thumbs_dir).st_mtime
+                with os.scandir(thumbs_dir) as entries:
+                    thumbnails.extend((entry.name, f'{thumbs_dir}/{entry.name}') for entry in entries
+                                      if fnmatch.fnmatch(entry.name, '*.jpg'))
+            except OSError:
+                continue
+
+        thumbnail = min(thumbnails, key=lambda item: item[0].lower())[1] if thumbnails else None
+        return {
+            'mtime': session_mtime,
+            'thumbnail': thumbnail,
+            # a session with a thumbnail keeps it, only the empty sessions need to be checked again
+            'folders': {} if thumbnail else folder_mtimes,
+        }
+
+    def is_outdated(self, entry, session_mtime):
+        """Returns True if the session folder or one of its empty thumbnail folders changed since it was scanned"""
+        if entry is None or entry['mtime'] != session_mtime:
+            return True
+        for folder, mtime in entry['folders'].items():
+            try:
+                if os.stat(folder).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def ensure_refreshed(self):
+        """Refreshes the index once per run, the other threads waiting for the refresh to finish"""
+        with self.refresh_lock:
+            if self.is_refresh_started:
+                return
+            self.is_refresh_started = True
+            self.is_refreshed = self.refresh()
+        self.save()
+
+    def refresh(self):
+        """Lists the thumbnails root folder once, and scans again the session folders which
+        are new or changed since the last refresh. Returns False if the root folder could not be listed"""
+        self.logger.info(f"Refreshing the thumbnail index of {self.root_dir}")
+        index = {}
+        total_scanned = 0
+        try:
+            with os.scandir(self.root_dir) as entries:
+                # the modification time comes with the listing on Windows, without a request per folder
+                session_folders = [(entry.name, entry.stat().st_mtime) for entry in entries if entry.is_dir()]
+        except OSError as exception:
+            self.logger.error(f"Error while listing the thumbnails folder {self.root_dir}. Error: {exception}")
+            return False
+
+        with self.lock:
+            previous_index = self.index
+        for session_public_id, session_mtime in session_folders:
+            entry = previous_index.get(session_public_id)
+            if self.is_outdated(entry, session_mtime):
+                entry = self.scan_session(session_public_id, session_mtime)
+                total_scanned += 1
+            index[session_public_id] = entry
+
+        with self.lock:
+            self.index = index
+            self.changed = True
+        self.logger.info(
+            f"Thumbnail index refreshed, {total_scanned} session folders scanned out of {len(index)}")
+        return True
+
+    def get_thumbnail(self, session_public_id):
+        """Returns the path of the first thumbnail of a session, or None if it has no thumbnail
+        :param session_public_id: public id of the session
+        """
+        with self.lock:
+            if session_public_id in self.resolved:
+                return self.resolved[session_public_id]
+            entry = self.index.get(session_public_id)
+
+        # the root folder is only listed once a session is missing from the index, so that a run
+        # looking up a few known sessions, like a change tracking run, does not scan the whole share
+        if entry is None and self.prebuild_index:
+            self.ensure_refreshed()
+            with self.lock:
+                entry = self.index.get(session_public_id)
+
+        # the entries of a refreshed index are up to date, the others are checked against the share
+        if entry is None or not self.is_refreshed:
+            entry = self.check_session(session_public_id, entry)
+
+        thumbnail = entry['thumbnail'] if entry else None
+        with self.lock:
+            self.resolved[session_public_id] = thumbnail
+        return thumbnail
+
+    def check_session(self, session_public_id, entry):
+        """Scans a session folder again if it changed since its entry was recorded.
+        Returns the entry of the session, or None if the session has no folder
+        :param session_public_id: public id of the session
+        :param entry: entry of the session in the index, or None
+        """
+        try:
+            session_mtime = os.stat(f'{self.root_dir}/{session_public_id}').st_mtime
+        except OSError:
+            return None
+        if not self.is_outdated(entry, session_mtime):
+            return entry
+
+        entry = self.scan_session(session_public_id, session_mtime)
+        with self.lock:
+            self.index[session_public_id] = entry
+            self.changed = True
+        return entry
+
+    def resolve(self, session_public_ids):
+        """Starts resolving the thumbnails of sessions on the thread pool
+        :param session_public_ids: list of session public ids
+        Returns:
+            futures: dictionary of session public id and the future of its thumbnail path
+        """
+        return {session_public_id: self.executor.submit(self.get_thumbnail, session_public_id)
+                for session_public_id in dict.fromkeys(session_public_ids)}
+
+    def close(self):
+        """Waits for the pending lookups and saves the index"""
+        self.executor.shutdown(wait=True)
+        self.save()
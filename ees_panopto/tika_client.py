@@ -0,0 +1,268 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""tika_client module allows to extract the text of the files with one or more Tika servers.
+
+    Each Tika server keeps a session of keep-alive connections shared by the threads. The
+    requests are spread over the servers in turn, a server which can not be reached is left out
+    until it answers its health check again, and the number of files sent at the same time is capped.
+    The files are uploaded as streams, without being copied into the request.
+"""
+import io
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIKA_ENDPOINTS = ['http://localhost:9998/']
+
+# seconds to wait for a Tika server to accept a connection, or to answer its health check
+CONNECT_TIMEOUT = 10
+
+
+class TikaClientException(Exception):
+    """Exception raised when no Tika server could be reached.
+
+    Attributes:
+        errors -- errors of the servers tried
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"No Tika server could be reached. Errors: {errors}")
+        self.errors = errors
+
+
+class TikaEndpoint:
+    """This class keeps the session and the health of a Tika server"""
+
+    def __init__(self, url, max_connections):
+        """
+        :param url: url of the Tika server
+        :param max_connections: maximum number of connections open to the server at the same time
+        """
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.session.trust_env = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.is_healthy = True
+        # monotonic time after which an unhealthy server is checked again
+        self.check_at = 0.0
+
+        self.total_requests = 0
+        self.total_failures = 0
+
+
+class TikaClient:
+    """This class sends the files to the Tika servers in turn, and returns their text"""
+
+    def __init__(self, logger, endpoints=None, max_concurrency=8, timeout=300, health_check_interval=30,
+                 pdf_min_page_text_length=None, pdf_ocr_workers=None):
+        """
+        :param logger: logger object
+        :param endpoints: urls of the Tika servers
+        :param max_concurrency: maximum number of files sent to the Tika servers at the same time
+        :param timeout: seconds to wait for the text of a file
+        :param health_check_interval: seconds after which an unreachable server is checked again
+        :param pdf_min_page_text_length: number of non blank characters below which a pdf page is sent
+            to the OCR by utils.run_tika, None for its default
+        :param pdf_ocr_workers: number of pdf pages sent to the OCR at the same time by utils.run_tika,
+            None for its default
+        """
+        self.name = "Tika"
+        self.logger = logger
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pdf_min_page_text_length = pdf_min_page_text_length
+        self.pdf_ocr_workers = pdf_ocr_workers
+        # a single server may have to take all the requests while the others are down
+        self.endpoints = [TikaEndpoint(url, max_concurrency) for url in endpoints or DEFAULT_TIKA_ENDPOINTS]
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.next_index = 0
+
+        self.total_waits = 0
+        self.total_wait_time = 0.0
+
+    def get_endpoints(self):
+        """Returns the servers to try for a request, starting from the next one in turn. The healthy
+        servers come first, followed by the unhealthy ones due for a health check which answered it"""
+        with self.lock:
+            start = self.next_index
+            self.next_index = (start + 1) % len(self.endpoints)
+            ordered_endpoints = self.endpoints[start:] + self.endpoints[:start]
+
+            now = time.monotonic()
+            due_endpoints = []
+            for endpoint in ordered_endpoints:
+                if not endpoint.is_healthy and now >= endpoint.check_at:
+                    # the other threads skip the server while it is checked
+                    endpoint.check_at = now + self.health_check_interval
+                    due_endpoints.append(endpoint)
+
+        healthy_endpoints = [endpoint for endpoint in ordered_endpoints if endpoint.is_healthy]
+        return healthy_endpoints + [endpoint for endpoint in due_endpoints if self.check_health(endpoint)]
+
+    def check_health(self, endpoint):
+        """Returns True if a Tika server answers, and marks it healthy again
+        :param endpoint: Tika server to check
+        """
+        try:
+            response = endpoint.session.get(f"{endpoint.url}/tika", timeout=CONNECT_TIMEOUT)
+        except requests.RequestException as exception:
+            self.logger.debug(f"Tika server {endpoint.url} is still unreachable. Error: {exception}")
+            return False
+        if not response.ok:
+            return False
+
+        self.logger.info(f"Tika server {endpoint.url} is reachable again")
+        endpoint.is_healthy = True
+        return True
+
+    def mark_unhealthy(self, endpoint, error):
+        """Leaves a Tika server out of the requests until its next health check
+        :param endpoint: Tika server which failed
+        :param error: error of the failed request
+        """
+        with self.lock:
+            endpoint.total_failures += 1
+            if endpoint.is_healthy:
+                endpoint.is_healthy = False
+                endpoint.check_at = time.monotonic() + self.health_check_interval
+                self.logger.error(
+                    f"Tika server {endpoint.url} is unreachable, retrying in {self.health_check_interval} seconds."
+                    f" Error: {error}")
+
+    def put(self, open_body, headers):
+        """Sends a file to the Tika servers until one of them answers, waiting while the maximum
+        number of files are being sent
+        :param open_body: function returning a new file object of the content for each attempt
+        :param headers: headers of the request
+        Returns:
+            response: response of the Tika server
+        """
+        start_time = time.monotonic()
+        with self.semaphore:
+            wait_time = time.monotonic() - start_time
+            if wait_time > 0.001:
+                with self.lock:
+                    self.total_waits += 1
+                    self.total_wait_time += wait_time
+
+            errors = []
+            for endpoint in self.get_endpoints():
+                with self.lock:
+                    endpoint.total_requests += 1
+                try:
+                    with open_body() as body:
+                        response = endpoint.session.put(
+                            f"{endpoint.url}/tika", data=body, headers=headers,
+                            timeout=(CONNECT_TIMEOUT, self.timeout))
+                except requests.exceptions.ConnectionError as exception:
+                    # the file was not processed, another server can take it
+                    self.mark_unhealthy(endpoint, exception)
+                    errors.append(f"{endpoint.url}: {exception}")
+                    continue
+
+                if response.status_code == 503:
+                    self.mark_unhealthy(endpoint, response.reason)
+                    errors.append(f"{endpoint.url}: {response.reason}")
+                    continue
+                return response
+
+        raise TikaClientException(errors or ['every server is waiting for its next health check'])
+
+    def get_text(self, response):
+        """Returns the text of a Tika response, an empty text if the file has no text,
+        or None if the file could not be parsed
+        :param response: response of the Tika server
+        """
+        if response.status_code == 204:
+            return ''
+        if not response.ok:
+            self.logger.warning(f"Tika could not extract the text of the file. Error: {response.status_code} "
+                                f"{response.reason}")
+            return None
+        response.encoding = response.encoding or 'utf-8'
+        return response.text
+
+    @staticmethod
+    def get_headers(lang=None):
+        """Returns the headers of a request
+        :param lang: languages of the OCR, like eng+chi_tra, None for the languages of the Tika server
+        """
+        headers = {'Accept': 'text/plain'}
+        if lang:
+            headers['X-Tika-OCRLanguage'] = lang
+        return headers
+
+    def extract_buffer(self, content, lang=None):
+        """Extracts the text of a content
+        :param content: content of the file, as bytes or str
+        :param lang: languages of the OCR
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        response = self.put(lambda: io.BytesIO(content), self.get_headers(lang))
+        return self.get_text(response)
+
+    def extract_file(self, path, lang=None):
+        """Extracts the text of a file
+        :param path: path of the file
+        :param lang: languages of the OCR
+        """
+        headers = self.get_headers(lang)
+        # the file name helps Tika to detect the type of the file
+        headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(path)}"'
+        response = self.put(lambda: open(path, 'rb'), headers)
+        return self.get_text(response)
+
+    def get_stats(self):
+        """Returns the request and the wait time metrics of the Tika servers"""
+        with self.lock:
+            return {
+                'endpoints': {
+                    endpoint.url: {
+                        'healthy': endpoint.is_healthy,
+                        'total_requests': endpoint.total_requests,
+                        'total_failures': endpoint.total_failures,
+                    } for endpoint in self.endpoints
+                },
+                'total_waits': self.total_waits,
+                'total_wait_time': round(self.total_wait_time, 3),
+            }
+
+    def close_all(self):
+        """Closes the idle connections to the Tika servers"""
+        for endpoint in self.endpoints:
+            endpoint.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def set_default_client(client):
+    """Sets the client used by the text extraction functions of the utils module
+    :param client: TikaClient object
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+
+def get_default_client():
+    """Returns the client used by the text extraction functions of the utils module,
+    the local Tika server if no client was set"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = TikaClient(logging.getLogger(__name__))
+        return _default_client
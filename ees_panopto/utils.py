@@ -8,18 +8,31 @@
 import csv
 import hashlib
 import os
+import subprocess
 import sys
 import tempfile
 import time
 import urllib.parse
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import urlparse
 
-from pdf2image import convert_from_bytes, convert_from_path
-from tika import parser
-
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes
 from .constant import RFC_3339_DATETIME_FORMAT
+from .extraction_cache import get_default_cache
+from .tika_client import get_default_client
+
+POPPLER_PATH = r"C:\poppler-23.08.0\Library\bin"
+
+# Pages of a pdf with fewer characters of embedded text are considered scanned, and sent to the OCR.
+# Used when the Tika client is not configured, otherwise set by tika.pdf_min_page_text_length
+PDF_MIN_PAGE_TEXT_LENGTH = 20
+
+# Number of scanned pdf pages sent to the OCR at the same time.
+# Used when the Tika client is not configured, otherwise set by tika.pdf_ocr_workers
+PDF_OCR_WORKERS = 4
 
 
 def is_website_url(url):
@@ -28,51 +41,178 @@ def is_website_url(url):
     return parsed_url.scheme in ['http', 'https'] and parsed_url.netloc != ''
 
 
-def run_tika(path, content):
-    file_extension = os.path.splitext(path)[1].lower()
-    extracted_text = ''
-    if file_extension == '.pdf':
+def extract_pdf_text_layer(pdf_path):
+    """Returns the embedded text of each page of a pdf file, using pdftotext from poppler
+    :param pdf_path: path of the pdf file
+    Returns:
+        pages: list of the texts of the pages
+    """
+    result = subprocess.run(
+        [os.path.join(POPPLER_PATH, 'pdftotext'), '-enc', 'UTF-8', pdf_path, '-'],
+        capture_output=True,
+        check=True,
+        timeout=300,
+    )
+    # pdftotext ends each page with a form feed
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    return pages[:-1] if pages and not pages[-1].strip() else pages
+
+
+def get_page_windows(page_numbers, window_size):
+    """Groups sorted page numbers in windows of consecutive pages, of at most window_size pages each
+    :param page_numbers: sorted list of page numbers
+    :param window_size: maximum number of pages in a window
+    """
+    windows = []
+    for page_number in page_numbers:
+        if windows and page_number == windows[-1][-1] + 1 and len(windows[-1]) < window_size:
+            windows[-1].append(page_number)
+        else:
+            windows.append([page_number])
+    return windows
+
+
+def ocr_page_image(image_path, lang=None):
+    """Extracts the text of a page image with the Tika OCR, and removes the image.
+    Returns None if the page could not be read
+    :param image_path: path of the image
+    :param lang: languages of the OCR
+    """
+    try:
+        return extract_text_from_file(image_path, lang)
+    finally:
+        try:
+            os.remove(image_path)
+        except OSError:
+            pass
+
+
+def ocr_pdf_pages(content, page_numbers, output_folder, workers=PDF_OCR_WORKERS, lang=None):
+    """Rasterizes pages of a pdf and extracts their text with the Tika OCR, several pages at a time.
+    The pages are rendered by windows of consecutive pages, the next window being rendered while
+    the pages of the previous one are read, so that only two windows are on disk at once
+    :param content: content of the pdf
+    :param page_numbers: sorted numbers of the pages, starting from 1
+    :param output_folder: folder where the page images are written
+    :param workers: number of pages sent to the OCR at the same time
+    :param lang: languages of the OCR
+    Returns:
+        texts: dictionary of page number and text, None for the pages which could not be read
+    """
+    texts = {}
+    pending_windows = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for window in get_page_windows(page_numbers, workers):
+            image_paths = convert_from_bytes(
+                content, output_folder=output_folder, fmt="jpeg", poppler_path=POPPLER_PATH,
+                first_page=window[0], last_page=window[-1], paths_only=True)
+            pending_windows.append(
+                {page_number: executor.submit(ocr_page_image, image_path, lang)
+                 for page_number, image_path in zip(window, image_paths)})
+
+            while len(pending_windows) > 1:
+                for page_number, future in pending_windows.popleft().items():
+                    texts[page_number] = future.result()
+
+        while pending_windows:
+            for page_number, future in pending_windows.popleft().items():
+                texts[page_number] = future.result()
+    return texts
+
+
+def run_tika(path, content, lang=None, min_page_text_length=None, ocr_workers=None):
+    """Extracts the text of a file, or returns it from the extraction cache if the same content was already read.
+    A text with pages which could not be read is returned without being cached, so they are read again next time
+    :param path: path of the file
+    :param content: content of the file
+    :param lang: languages of the Tika OCR, like eng+chi_tra, None for the languages of the Tika server
+    :param min_page_text_length: number of non blank characters below which a pdf page is sent to the OCR,
+        defaults to the setting of the Tika client
+    :param ocr_workers: number of pdf pages sent to the OCR at the same time, defaults to the setting of the Tika client
+    """
+    tika_client = get_default_client()
+    if min_page_text_length is None:
+        min_page_text_length = tika_client.pdf_min_page_text_length
+    if min_page_text_length is None:
+        min_page_text_length = PDF_MIN_PAGE_TEXT_LENGTH
+    if ocr_workers is None:
+        ocr_workers = tika_client.pdf_ocr_workers or PDF_OCR_WORKERS
+
+    cache = get_default_cache()
+    if not cache:
+        return extract_content(path, content, lang, min_page_text_length, ocr_workers)[0]
+
+    # a pdf is read from its text layer and the OCR of the pages below the threshold, any other file by Tika
+    # alone, so the same content gives different texts depending on the extractor and the threshold
+    text_extractor = f'pdf:{min_page_text_length}' if is_pdf(path) else 'tika'
+    key = cache.get_key(content, f'tika:{text_extractor}', lang)
+    text = cache.get(key)
+    if text is None:
+        text, complete = extract_content(path, content, lang, min_page_text_length, ocr_workers)
+        if complete:
+            cache.put(key, text)
+    return text
+
+
+def is_pdf(path):
+    """Returns True if the file is read as a pdf by extract_content
+    :param path: path of the file
+    """
+    return os.path.splitext(path)[1].lower() == '.pdf'
+
+
+def extract_content(path, content, lang=None, min_page_text_length=PDF_MIN_PAGE_TEXT_LENGTH,
+                    ocr_workers=PDF_OCR_WORKERS):
+    """Extracts the text of a file with Tika. The pages of a pdf having an embedded text layer are read directly,
+    and only the pages with less than min_page_text_length characters of text are rasterized for the OCR
+    :param path: path of the file
+    :param content: content of the file
+    :param lang: languages of the Tika OCR
+    :param min_page_text_length: number of non blank characters below which a pdf page is sent to the OCR
+    :param ocr_workers: number of pdf pages sent to the OCR at the same time
+    Returns:
+        extracted_text: text of the file, the pages of a pdf which could not be read being left empty,
+            or None if the file could not be read
+        complete: False if the file or one of its pages could not be read
+    """
+    if is_pdf(path):
         with tempfile.TemporaryDirectory() as temp_dir:
-            images = None
-            try: 
-                images = convert_from_bytes(content, output_folder=temp_dir, fmt="jpeg", poppler_path=r"C:\poppler-23.08.0\Library\bin")
-
-                # Extract text from each image
-                for image in images:     
-                    print(image.filename)
-                    text = extract_text_from_file(image.filename)
-
-                    if text:
-                        extracted_text += text
-
-                for image in images:
-                    image.close()  # Close the image once we are done with it
-            except Exception as exception:
-                raise exception
-            finally:
-                if images:
-                    for image in images:
-                        image.close()
-    else:
-        extracted_text = extract(content)
-    return extracted_text
+            pdf_path = os.path.join(temp_dir, 'content.pdf')
+            with open(pdf_path, 'wb') as pdf_file:
+                pdf_file.write(content)
+
+            try:
+                pages = extract_pdf_text_layer(pdf_path)
+            except (OSError, subprocess.SubprocessError):
+                # without pdftotext, every page goes through the OCR
+                pages = [''] * pdfinfo_from_bytes(content, poppler_path=POPPLER_PATH)['Pages']
+
+            scanned_pages = [number for number, text in enumerate(pages, start=1)
+                             if len(''.join(text.split())) < min_page_text_length]
+            ocr_texts = ocr_pdf_pages(content, scanned_pages, temp_dir, ocr_workers, lang)
+
+            extracted_text = ''.join(
+                (ocr_texts[number] or '') if number in ocr_texts else text
+                for number, text in enumerate(pages, start=1))
+            return extracted_text, None not in ocr_texts.values()
+
+    extracted_text = extract(content, lang)
+    return extracted_text, extracted_text is not None
 
-def extract(content):
+def extract(content, lang=None):
     """Extracts the contents
     :param content: content to be extracted
+    :param lang: languages of the Tika OCR
     Returns:
         parsed_test: parsed text
     """
-    parsed = parser.from_buffer(content, 'http://localhost:9998/', requestOptions={'timeout': 300})
-    parsed_text = parsed["content"]
-    return parsed_text
+    return get_default_client().extract_buffer(content, lang)
 
 
-def extract_text_from_file(path):
+def extract_text_from_file(path, lang=None):
     # Use Apache Tika to extract text from the image
-    parsed = parser.from_file(path, 'http://localhost:9998/', requestOptions={'timeout': 300})
-    parsed_text = parsed["content"]
-    return parsed_text
+    return get_default_client().extract_file(path, lang)
+
 
 def url_encode(object_name):
     """Performs encoding on the name of objects
@@ -198,6 +338,33 @@ def split_date_range_into_chunks(start_time, end_time, number_of_threads):
     datelist.append(formatted_end_time)
     return datelist
 
+def split_date_range_by_density(start_time, end_time, histogram, number_of_partitions):
+    """Divides the timerange in partitions holding about the same number of items
+    :param start_time: start time of the interval
+    :param end_time: end time of the interval
+    :param histogram: list of tuples of bucket start time and number of items in the bucket, sorted by time
+    :param number_of_partitions: number of partitions to be formed
+    Returns:
+        partitions: list of tuples of start time and end time, at most number_of_partitions of them
+    """
+    total = sum(count for _, count in histogram)
+    if not total:
+        return [(start_time, end_time)]
+
+    items_per_partition = total / number_of_partitions
+    boundaries = [start_time]
+    items_before_bucket = 0
+    for bucket_start, count in histogram:
+        # start a new partition at the first bucket beyond the share of the previous partitions
+        if items_before_bucket >= items_per_partition * len(boundaries) and \
+                boundaries[-1] < bucket_start < end_time:
+            boundaries.append(bucket_start)
+        items_before_bucket += count
+    boundaries.append(end_time)
+
+    return list(zip(boundaries, boundaries[1:]))
+
+
 def get_current_time():
     """Returns current time in rfc 3339 format"""
     return (datetime.utcnow()).strftime(RFC_3339_DATETIME_FORMAT)
@@ -0,0 +1,54 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""Compares the time taken by the text extractors to build the bodies of sessions, and whether their bodies match.
+
+    Run with: python -m tests.benchmark_text_extractor [total_sessions] [texts_per_session]
+"""
+import sys
+import time
+
+from ees_panopto.sync_panopto import DocumentBuilder
+
+from .text_extractor_payloads import get_sessions
+
+
+def measure(builder, sessions, repeat=5):
+    """Returns the best time taken to build the bodies of the sessions, and the bodies
+    :param builder: DocumentBuilder object
+    :param sessions: list of the ordered texts of the sessions
+    :param repeat: number of runs
+    """
+    best_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        bodies = [builder.build_body(contents) for contents in sessions]
+        elapsed_time = time.perf_counter() - start_time
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+    return best_time, bodies
+
+
+def main():
+    total_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    texts_per_session = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    sessions = get_sessions(total_sessions, texts_per_session)
+    total_texts = sum(len(contents) for contents in sessions)
+    print(f"{total_sessions} sessions, {total_texts} texts")
+
+    results = {}
+    for text_extractor in ['beautifulsoup', 'regex']:
+        builder = DocumentBuilder('https://panopto', {}, 'client', text_extractor)
+        results[text_extractor] = measure(builder, sessions)
+        print(f"{text_extractor}: {results[text_extractor][0] * 1000:.1f} ms")
+
+    print(f"speedup: {results['beautifulsoup'][0] / results['regex'][0]:.1f}x")
+    different_bodies = sum(
+        regex_body != beautifulsoup_body
+        for regex_body, beautifulsoup_body in zip(results['regex'][1], results['beautifulsoup'][1]))
+    print(f"different bodies: {different_bodies} out of {total_sessions}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""Checks the queries sent by fetch_session_bodies, and the bodies it returns, through a fake cursor."""
+import logging
+from collections import namedtuple
+from types import SimpleNamespace
+
+from ees_panopto.mssql_client import MSSQL
+from ees_panopto.sync_panopto import (MAX_SESSIONS_PER_BODY_QUERY, DocumentBuilder, SyncPanopto,
+                                      query_session_bodies)
+
+Row = namedtuple('Row', ['sessionID', 'body'])
+
+
+class FakeCursor:
+    """Records the executed queries, and returns the bodies of the sessions given as parameters"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((query, list(params or [])))
+        session_ids = dict.fromkeys(params or [])
+        self.rows = [Row(session_id, self.connection.bodies[session_id])
+                     for session_id in session_ids if session_id in self.connection.bodies]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def create_sync_panopto():
+    mssql_client = MSSQL.__new__(MSSQL)
+    mssql_client.logger = logging.getLogger(__name__)
+    sync_panopto = SyncPanopto.__new__(SyncPanopto)
+    sync_panopto.mssql_client = mssql_client
+    return sync_panopto
+
+
+def test_session_bodies_query_takes_the_session_ids_in_each_part():
+    """A single query is sent for a small block, with the session ids once for each part of its union"""
+    connection = FakeConnection({1: 'Title\n<p>Caption</p>', 2: 'Other'})
+    session_bodies = create_sync_panopto().fetch_session_bodies(connection, [1, 2, 1, 3])
+
+    assert session_bodies == {1: 'Title\n<p>Caption</p>', 2: 'Other'}
+    assert len(connection.executed) == 1
+    query, params = connection.executed[0]
+    assert query == query_session_bodies.format(session_ids='?, ?, ?')
+    assert 'string_agg' in query
+    assert query.count('?') == len(params)
+    assert params == [1, 2, 3] * 6
+
+
+def test_session_bodies_are_queried_by_chunks_under_the_parameter_limit():
+    """A block of more sessions than a query can take is sent in several queries"""
+    session_ids = list(range(MAX_SESSIONS_PER_BODY_QUERY + 10))
+    connection = FakeConnection({session_id: f'body {session_id}' for session_id in session_ids})
+    session_bodies = create_sync_panopto().fetch_session_bodies(connection, session_ids)
+
+    assert session_bodies == {session_id: f'body {session_id}' for session_id in session_ids}
+    assert [len(params) for _, params in connection.executed] == [MAX_SESSIONS_PER_BODY_QUERY * 6, 10 * 6]
+    for query, params in connection.executed:
+        # SQL Server accepts at most 2100 parameters
+        assert query.count('?') == len(params) < 2100
+
+
+def test_server_side_bodies_are_used_for_the_documents():
+    """The documents of the videos get the text of the body of their session, or an empty body"""
+    connection = FakeConnection({1: 'Title\n<p>Caption &amp; slide</p>'})
+    session_bodies = create_sync_panopto().fetch_session_bodies(connection, [1, 2])
+
+    videos = [
+        SimpleNamespace(publicID='video-1', sessionID=1, longName='Title', abstract=None, startTime=0),
+        SimpleNamespace(publicID='video-2', sessionID=2, longName='Empty', abstract=None, startTime=0),
+    ]
+    for text_extractor in ['regex', 'beautifulsoup']:
+        builder = DocumentBuilder('https://panopto', {}, 'server', text_extractor)
+        docs = builder.build_documents(videos, session_bodies)
+        assert [doc['body'] for doc in docs] == ['Title\nCaption & slide', '']
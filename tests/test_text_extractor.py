@@ -0,0 +1,56 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""Checks that the regex text extractor gives the same bodies as BeautifulSoup."""
+from ees_panopto.sync_panopto import DocumentBuilder
+
+from .text_extractor_payloads import (ABSTRACTS, CAPTIONS, EVENTS, SLIDE_CONTENTS, SLIDE_TITLES, TITLES,
+                                      get_sessions)
+
+regex_builder = DocumentBuilder('https://panopto', {}, 'client', 'regex')
+beautifulsoup_builder = DocumentBuilder('https://panopto', {}, 'client', 'beautifulsoup')
+
+
+def test_each_text_is_extracted_like_beautifulsoup():
+    """Each caption, event and slide text gives the same text with both extractors"""
+    for text in TITLES + ABSTRACTS + CAPTIONS + EVENTS + SLIDE_TITLES + SLIDE_CONTENTS:
+        assert regex_builder.extract_text(text) == beautifulsoup_builder.extract_text(text), text
+
+
+def test_session_bodies_are_built_like_beautifulsoup():
+    """The bodies built from the texts of sessions are the same with both extractors"""
+    for contents in get_sessions():
+        assert regex_builder.build_body(contents) == beautifulsoup_builder.build_body(contents)
+
+
+def test_server_side_bodies_are_extracted_like_beautifulsoup():
+    """The bodies aggregated by the server give the same text with both extractors"""
+    for contents in get_sessions():
+        body = DocumentBuilder.assemble_body(contents)
+        assert regex_builder.extract_text(body) == beautifulsoup_builder.extract_text(body)
+
+
+def test_markup_edge_cases_are_extracted_like_beautifulsoup():
+    """Quoted attribute values, references without semicolon, CDATA sections and unusual end tags give the
+    same text with both extractors"""
+    fragments = [
+        '<p title="a>b">t</p>',
+        "<a href='q>r'>link</a>",
+        "<p don't>t</p>",
+        'A &amp B',
+        '&ampB',
+        '5 &gt3 and 2 &lt;4',
+        '&notit; &copy 2020',
+        'AT&T',
+        '&nbsp',
+        '&#65;&#x42 &#67',
+        '<![CDATA[x<y]]> and z',
+        'a</ b>c',
+        'a<!--->b<!---->c',
+        '<!DOCTYPE html>a<?pi?>b',
+        '<p>a<script>var b = "<p>";</script>c</p>',
+    ]
+    for fragment in fragments:
+        assert regex_builder.extract_text(fragment) == beautifulsoup_builder.extract_text(fragment), fragment
@@ -0,0 +1,86 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""Caption, event and slide texts shaped like the ones stored by Panopto, used to compare the text extractors."""
+
+TITLES = [
+    'Introduction to Statistics &amp; Probability',
+    'Week 3 - Organic Chemistry (Part 2)',
+    "Lecture 12: Newton's laws",
+    'MATH1010 Tutorial &lt;Group B&gt;',
+]
+
+ABSTRACTS = [
+    None,
+    '',
+    'Recorded in room LT-1. Slides are available on the course page.',
+    '<p>This lecture covers <b>hypothesis testing</b> and <i>p-values</i>.</p>',
+]
+
+CAPTIONS = [
+    'Good morning everyone, let us get started.',
+    "So today we're going to look at the second chapter",
+    'if x < 5 then the function is decreasing',
+    'the ratio is 3 > 2 so we keep going',
+    'A &amp; B are independent events',
+    '<i>[MUSIC PLAYING]</i>',
+    '<font color="#ffffff">and this is the key point</font>',
+    'Questions?',
+    '',
+    None,
+    '同學們好，今天我們討論第三章',
+    'the price is 5&nbsp;dollars',
+    'Q&A session after the break',
+]
+
+EVENTS = [
+    'Chapter 1',
+    'Demo',
+    'Break',
+    None,
+]
+
+SLIDE_TITLES = [
+    'Outline',
+    'Definition of the mean',
+    'Example &#8211; coin toss',
+    '',
+]
+
+SLIDE_CONTENTS = [
+    '<p>Agenda</p><ul><li>Recap</li><li>New material</li><li>Exercises</li></ul>',
+    '<p>The mean is <b>&Sigma;x / n</b></p>',
+    '<div class="slide"><p>P(A &cap; B) = P(A) &times; P(B)</p></div>',
+    'Plain text slide without any markup',
+    '<p>Line one<br/>Line two<br>Line three</p>',
+    '<!-- speaker notes hidden --><p>Visible text</p>',
+    '<style>.title { color: red; }</style><p>Styled slide</p>',
+    '<table><tr><td>1</td><td>2</td></tr></table>',
+    '<p>Unicode: café, naïve, 數學</p>',
+    None,
+]
+
+
+def get_sessions(total_sessions=50, texts_per_session=40):
+    """Returns the ordered texts of sessions, cycling through the payloads like a Panopto session:
+    title, abstract, then captions, events, slide titles and slide contents
+    :param total_sessions: number of sessions
+    :param texts_per_session: number of caption, event and slide texts of each session
+    """
+    sessions = []
+    for session_index in range(total_sessions):
+        contents = [TITLES[session_index % len(TITLES)], ABSTRACTS[session_index % len(ABSTRACTS)]]
+        for text_index in range(texts_per_session):
+            position = session_index + text_index
+            caption = CAPTIONS[position % len(CAPTIONS)]
+            # most captions of a session are different sentences, only a few are repeated
+            contents.append(f'{caption} {text_index}' if caption and text_index % 4 else caption)
+            if text_index % 5 == 0:
+                contents.append(EVENTS[position % len(EVENTS)])
+            if text_index % 3 == 0:
+                contents.append(SLIDE_TITLES[position % len(SLIDE_TITLES)])
+                contents.append(SLIDE_CONTENTS[position % len(SLIDE_CONTENTS)])
+        sessions.append(contents)
+    return sessions